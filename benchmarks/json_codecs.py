@@ -0,0 +1,60 @@
+import importlib.util
+import timeit
+
+import typer
+from tabulate import tabulate
+
+from bloodaxe import JSON_CODECS, make_json_codec
+
+TABLE_HEADERS = ["Payload", "Codec", "Size", "Encode µs", "Decode µs"]
+MICROSECONDS_MASK = "{0:.2f}"
+
+USER = {
+    "id": 1,
+    "firstname": "Bjorn",
+    "lastname": "Ironside",
+    "email": "bjorn.ironside@kattegat.com",
+    "status": "active",
+    "roles": ["admin", "raider"],
+    "address": {"street": "Fjord Road", "city": "Kattegat", "zip": "12345"},
+    "score": 98.5,
+    "verified": True,
+}
+
+PAYLOADS = {
+    "token": {"access_token": "x" * 512, "token_type": "Bearer", "expires_in": 3600},
+    "user": USER,
+    "users_page": {"count": 100, "next": None, "results": [dict(USER, id=index) for index in range(100)]},
+    "large_upload": {"items": [dict(USER, id=index, bio="y" * 1024) for index in range(1000)]},
+}
+
+app = typer.Typer()
+
+
+def measure(func, number):
+    return min(timeit.repeat(func, number=number, repeat=5)) / number * 1_000_000
+
+
+@app.command()
+def main(number: int = 200):
+    codecs = [make_json_codec(name) for name in JSON_CODECS if importlib.util.find_spec(name)]
+
+    rows = []
+    for payload_name, payload in PAYLOADS.items():
+        for codec in codecs:
+            encoded_payload = codec.dumps(payload)
+            rows.append(
+                [
+                    payload_name,
+                    codec.name,
+                    len(encoded_payload),
+                    MICROSECONDS_MASK.format(measure(lambda: codec.dumps(payload), number)),
+                    MICROSECONDS_MASK.format(measure(lambda: codec.loads(encoded_payload), number)),
+                ]
+            )
+
+    typer.echo(tabulate(rows, headers=TABLE_HEADERS))
+
+
+if __name__ == "__main__":
+    app()
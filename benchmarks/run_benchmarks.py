@@ -0,0 +1,201 @@
+import asyncio
+import json
+import multiprocessing
+import os
+import resource
+import time
+from contextlib import redirect_stdout
+from pathlib import Path
+
+import toml
+import typer
+from tabulate import tabulate
+
+from bloodaxe import StubServer, start
+
+FLOWS_DIR = Path(__file__).parent / "flows"
+MEMORY_SAMPLE_INTERVAL = 0.5
+MEGABYTE = 1024 * 1024
+
+TABLE_HEADERS = [
+    "Flow",
+    "Flows",
+    "Flows/s",
+    "Requests/s",
+    "CPU ms/request",
+    "RSS start MB",
+    "RSS peak MB",
+    "RSS end MB",
+]
+
+REGRESSION_MESSAGE = "Regression on {}: {}={:.3f}, baseline={:.3f}"
+START_BENCHMARK_MESSAGE = "Running benchmark, flow={}, number_of_concurrent_flows={}, duration={} seconds"
+
+app = typer.Typer()
+
+
+def get_rss():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def serve_stub(latency, payload_size, error_rate, ports, commands):
+    async def serve():
+        async with StubServer(
+            latency=latency, payload_size=payload_size, error_rate=error_rate
+        ) as stub_server:
+            ports.put(stub_server.port)
+            await asyncio.get_event_loop().run_in_executor(None, commands.get)
+            ports.put(stub_server.number_of_requests)
+
+    asyncio.run(serve())
+
+
+def start_stub(latency, payload_size, error_rate):
+    ports = multiprocessing.Queue()
+    commands = multiprocessing.Queue()
+    process = multiprocessing.Process(
+        target=serve_stub, args=(latency, payload_size, error_rate, ports, commands), daemon=True
+    )
+    process.start()
+
+    return process, ports.get(), ports, commands
+
+
+def stop_stub(process, ports, commands):
+    commands.put("stop")
+    number_of_requests = ports.get()
+    process.join()
+
+    return number_of_requests
+
+
+async def sample_memory(samples):
+    while True:
+        samples.append(get_rss())
+        await asyncio.sleep(MEMORY_SAMPLE_INTERVAL)
+
+
+async def run_benchmark(toml_data):
+    memory_samples = []
+    sampler = asyncio.ensure_future(sample_memory(memory_samples))
+    start_cpu_time = time.process_time()
+    start_time = time.perf_counter()
+
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        metrics = await start(toml_data, verbose=False)
+
+    elapsed_time = time.perf_counter() - start_time
+    cpu_time = time.process_time() - start_cpu_time
+    sampler.cancel()
+    memory_samples.append(get_rss())
+
+    return metrics, elapsed_time, cpu_time, memory_samples
+
+
+def benchmark_flow(flow_file, duration, concurrency, latency, payload_size, error_rate):
+    toml_data = toml.load(flow_file)
+    toml_data["configs"]["duration"] = duration
+    toml_data["configs"]["number_of_concurrent_flows"] = concurrency
+
+    process, port, ports, commands = start_stub(latency, payload_size, error_rate)
+    for api in toml_data["api"]:
+        api["base_url"] = f"http://127.0.0.1:{port}"
+
+    try:
+        metrics, elapsed_time, cpu_time, memory_samples = asyncio.run(run_benchmark(toml_data))
+    finally:
+        number_of_requests = stop_stub(process, ports, commands)
+
+    return {
+        "flows": metrics.total_flows,
+        "error_flows": metrics.error_flows,
+        "requests": number_of_requests,
+        "flows_per_second": metrics.total_flows / elapsed_time,
+        "requests_per_second": number_of_requests / elapsed_time,
+        "cpu_ms_per_request": cpu_time * 1000 / max(number_of_requests, 1),
+        "memory_samples": memory_samples,
+    }
+
+
+def make_row(name, result):
+    memory_samples = result["memory_samples"]
+
+    return [
+        name,
+        result["flows"],
+        f"{result['flows_per_second']:.1f}",
+        f"{result['requests_per_second']:.1f}",
+        f"{result['cpu_ms_per_request']:.3f}",
+        f"{memory_samples[0] / MEGABYTE:.1f}",
+        f"{max(memory_samples) / MEGABYTE:.1f}",
+        f"{memory_samples[-1] / MEGABYTE:.1f}",
+    ]
+
+
+def find_regressions(results, baseline, tolerance):
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+
+        flows_per_second = baseline[name]["flows_per_second"]
+        if result["flows_per_second"] < flows_per_second * (1 - tolerance):
+            regressions.append(
+                REGRESSION_MESSAGE.format(
+                    name, "flows_per_second", result["flows_per_second"], flows_per_second
+                )
+            )
+
+        cpu_ms_per_request = baseline[name]["cpu_ms_per_request"]
+        if result["cpu_ms_per_request"] > cpu_ms_per_request * (1 + tolerance):
+            regressions.append(
+                REGRESSION_MESSAGE.format(
+                    name, "cpu_ms_per_request", result["cpu_ms_per_request"], cpu_ms_per_request
+                )
+            )
+
+    return regressions
+
+
+@app.command()
+def main(
+    flows_dir: Path = FLOWS_DIR,
+    duration: int = 10,
+    concurrency: int = 50,
+    latency: float = 0,
+    payload_size: int = 256,
+    error_rate: float = 0,
+    output: Path = None,
+    baseline: Path = None,
+    tolerance: float = 0.15,
+):
+    results = {}
+    for flow_file in sorted(flows_dir.glob("*.toml")):
+        typer.secho(
+            START_BENCHMARK_MESSAGE.format(flow_file.stem, concurrency, duration), fg=typer.colors.CYAN
+        )
+        results[flow_file.stem] = benchmark_flow(
+            flow_file, duration, concurrency, latency, payload_size, error_rate
+        )
+
+    typer.echo("\n")
+    typer.echo(tabulate([make_row(name, result) for name, result in results.items()], headers=TABLE_HEADERS))
+
+    if output:
+        output.write_text(json.dumps(results, indent=2))
+
+    if baseline:
+        regressions = find_regressions(results, json.loads(baseline.read_text()), tolerance)
+        for regression in regressions:
+            typer.secho(regression, fg=typer.colors.RED, bold=True)
+
+        if regressions:
+            raise typer.Exit(code=1)
+
+
+if __name__ == "__main__":
+    app()
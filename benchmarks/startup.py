@@ -0,0 +1,47 @@
+import statistics
+import subprocess
+import sys
+import time
+
+import typer
+from tabulate import tabulate
+
+TABLE_HEADERS = ["Command", "Median", "Min", "Max"]
+MILLISECONDS_MASK = "{0:.1f}ms"
+
+COMMANDS = {
+    "python": [sys.executable, "-c", "pass"],
+    "import bloodaxe": [sys.executable, "-c", "import bloodaxe"],
+    "bloodaxe --help": [sys.executable, "-m", "bloodaxe", "--help"],
+}
+
+app = typer.Typer()
+
+
+def measure(command, runs):
+    durations = []
+    for _ in range(runs):
+        start_time = time.perf_counter()
+        subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        durations.append(time.perf_counter() - start_time)
+
+    return durations
+
+
+@app.command()
+def main(runs: int = 20):
+    rows = []
+    for name, command in COMMANDS.items():
+        durations = measure(command, runs)
+        rows.append(
+            [
+                name,
+                *[MILLISECONDS_MASK.format(func(durations) * 1000) for func in (statistics.median, min, max)],
+            ]
+        )
+
+    typer.echo(tabulate(rows, headers=TABLE_HEADERS))
+
+
+if __name__ == "__main__":
+    app()
@@ -1,18 +1,62 @@
 import asyncio
-import copy
-import json
+import bisect
+import functools
+import gzip
+import importlib
+import itertools
+import math
 import os
-import statistics
+import random
+import re
+import signal
 import time
-from dataclasses import dataclass
+import zlib
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from datetime import datetime
+from enum import Enum
 from pathlib import Path
+from urllib.parse import urlsplit
 
-import httpx
-import toml
+import click
 import typer
-from httpx._exceptions import ConnectTimeout, HTTPError, NetworkError, ReadTimeout
-from jinja2 import Template
-from tabulate import tabulate
+
+
+class LazyModule:
+    def __init__(self, name):
+        self.__dict__["_name"] = name
+        self.__dict__["_module"] = None
+
+    def _load(self):
+        if self._module is None:
+            self.__dict__["_module"] = importlib.import_module(self._name)
+
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+
+httpx = LazyModule("httpx")
+jinja2 = LazyModule("jinja2")
+tabulate = LazyModule("tabulate")
+toml = LazyModule("toml")
+RUN_MODULES = (httpx, jinja2)
+
+JSON_CODECS = {
+    "orjson": lambda module: JsonCodec("orjson", module.dumps, module.loads),
+    "ujson": lambda module: JsonCodec(
+        "ujson", lambda data: module.dumps(data, escape_forward_slashes=False).encode(), module.loads
+    ),
+    "json": lambda module: JsonCodec("json", lambda data: module.dumps(data).encode(), module.loads),
+}
+JSON_CONTENT_TYPE = "application/json"
+
+COMPRESSIONS = {
+    "gzip": lambda body: gzip.compress(body, mtime=0),
+    "deflate": zlib.compress,
+}
+TEMPLATE_MARKERS = ("{{", "{%", "{#")
 
 HTTP_METHODS_FUNC_MAPPING = {
     "GET": "make_get_request",
@@ -21,6 +65,7 @@ HTTP_METHODS_FUNC_MAPPING = {
     "PATCH": "make_patch_request",
     "DELETE": "make_delete_request",
 }
+HTTP_METHODS_WITH_BODY = ("POST", "PUT", "PATCH")
 
 SUCCESS = typer.style("success", fg=typer.colors.GREEN, bold=True)
 ERROR = typer.style("error", fg=typer.colors.RED, bold=True)
@@ -29,12 +74,23 @@ REQUEST_INFO = typer.style("REQUEST_INFO", bg=typer.colors.GREEN, fg=typer.color
 
 REQUEST_MESSAGE = "Request {}: name={}, url={}"
 START_MESSAGE = "Start bloodaxe, number_of_concurrent_flows={}, duration={} seconds"
+WARMUP_MESSAGE = "Warming up for {} seconds, these flows are excluded from the metrics"
+VIRTUAL_USERS_WARNING = (
+    "virtual_users={} is lower than number_of_concurrent_flows={}, running {} concurrent flows instead"
+)
+STOP_MESSAGE = "Stopping bloodaxe, waiting up to {} seconds for running flows"
 RESPONSE_DATA_CHECK_FAILED_MESSAGE = "Failed to check response, request={}, " "expected data={}, received={}"
+INVALID_JSON_RESPONSE_MESSAGE = "Invalid json response, request={}, error={}"
 RESPONSE_STATUS_CODE_CHECK_FAILED_MESSAGE = (
     "Status code check failed, request={}, " "expected status_code={}, received={}"
 )
 SECONDS_MASK = "{0:.2f}"
 DEFAULT_TIMEOUT = 10
+DEFAULT_SHUTDOWN_TIMEOUT = 10
+HTTP_UNAUTHORIZED = 401
+
+CACHE_SCOPES = ("run", "worker", "virtual_user")
+DEFAULT_CACHE_SCOPE = "run"
 
 TABLE_HEADERS = [
     "Total success flows",
@@ -45,97 +101,553 @@ TABLE_HEADERS = [
     "Total time",
 ]
 
-HTTP_EXCEPTIONS = (HTTPError, NetworkError, ReadTimeout, ConnectTimeout)
+GENERATOR_TABLE_HEADERS = [
+    "Loop lag mean",
+    "Loop lag max",
+    "Templating",
+    "JSON",
+    "Compression",
+    "Checks",
+    "Output",
+    "CPU usage",
+]
+GENERATOR_OVERHEAD_WARNING = (
+    "Generator overloaded, loop lag mean={} and CPU usage={}, "
+    "latencies include bloodaxe own overhead and may not be trustworthy"
+)
+MILLISECONDS_MASK = "{0:.2f}ms"
+PERCENT_MASK = "{0:.1f}%"
+LOOP_LAG_PROBE_INTERVAL = 0.1
+LOOP_LAG_WARNING_THRESHOLD = 0.01
+CPU_USAGE_WARNING_THRESHOLD = 0.9
+
+OVERHEAD_TEMPLATING = "templating"
+OVERHEAD_JSON = "json"
+OVERHEAD_COMPRESSION = "compression"
+OVERHEAD_CHECKS = "checks"
+OVERHEAD_OUTPUT = "output"
+OVERHEAD_CATEGORIES = (
+    OVERHEAD_TEMPLATING,
+    OVERHEAD_JSON,
+    OVERHEAD_COMPRESSION,
+    OVERHEAD_CHECKS,
+    OVERHEAD_OUTPUT,
+)
+
+ERROR_TABLE_HEADERS = ["Request", "Error", "Count"]
+TRANSFER_TABLE_HEADERS = ["Request", "Sent", "Sent decoded", "Received", "Received decoded"]
+ERROR_SAMPLES_TITLE = "Error samples:"
+ERROR_SAMPLES_SIZE = 10
+
+ERROR_TIMEOUT = "timeout"
+ERROR_CONNECT = "connect_error"
+ERROR_HTTP = "http_error"
+ERROR_HTTP_STATUS = "http_{}xx"
+ERROR_CHECK_DATA = "check_data_failed"
+ERROR_CHECK_STATUS_CODE = "check_status_code_failed"
+ERROR_INVALID_METHOD = "invalid_method"
+ERROR_INVALID_JSON = "invalid_json"
+
+STUB_RESPONSE = (
+    "HTTP/1.1 {} {}\r\n"
+    "Content-Type: application/json\r\n"
+    "Content-Length: {}\r\n"
+    "Connection: keep-alive\r\n"
+    "\r\n"
+)
+STUB_STATUS = {200: "OK", 500: "Internal Server Error"}
+
+METRICS_SERVER_MESSAGE = "Serving metrics at http://{}:{}/metrics"
+METRICS_SERVER_ERROR_MESSAGE = "Could not serve metrics at {}:{}, error={}"
+METRICS_RESPONSE = (
+    "HTTP/1.1 200 OK\r\n"
+    "Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+    "Content-Length: {}\r\n"
+    "Connection: close\r\n"
+    "\r\n"
+)
+DEFAULT_METRICS_HOST = "127.0.0.1"
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+REPLAY_START_MESSAGE = "Start bloodaxe replay, log_file={}, speed={}, max_in_flight={}"
+REPLAY_SKIPPED_MESSAGE = "Skipped log lines, invalid={}, unmapped={}"
+ACCESS_LOG_PATTERN = re.compile(
+    r'^\S+ \S+ \S+ \[(?P<time>[^\]]+)\] "(?P<method>[A-Z]+) (?P<path>\S+)(?: [^"]*)?" \S+ \S+'
+)
+ACCESS_LOG_TIME_FORMAT = "%d/%b/%Y:%H:%M:%S %z"
+DEFAULT_COMMAND = "run"
+
+UVLOOP_NOT_INSTALLED_MESSAGE = "uvloop is not installed, install it with: pip install bloodaxe[uvloop]"
+
+THINK_TIME_DISTRIBUTIONS = {
+    "fixed": lambda config: config["value"],
+    "uniform": lambda config: random.uniform(config["min"], config["max"]),
+    "exponential": lambda config: random.expovariate(1 / config["mean"]),
+}
+THINK_TIME_PARAMETERS = {"fixed": ("value",), "uniform": ("min", "max"), "exponential": ("mean",)}
+
+REQUIRED_CONFIGS = ("duration", "number_of_concurrent_flows")
+POSITIVE_INTEGER_CONFIGS = ("number_of_concurrent_flows", "virtual_users")
+NON_NEGATIVE_NUMBER_CONFIGS = ("duration", "pacing", "warmup", "shutdown_timeout")
 
-app = typer.Typer()
+
+class DefaultCommandGroup(click.Group):
+    def parse_args(self, ctx, args):
+        group_options = {option for param in self.get_params(ctx) for option in param.opts}
+        if args and args[0] not in self.commands and args[0] not in group_options:
+            args = [DEFAULT_COMMAND, *args]
+
+        return super().parse_args(ctx, args)
+
+
+app = typer.Typer(cls=DefaultCommandGroup)
+
+
+class LogFormat(str, Enum):
+    auto = "auto"
+    common = "common"
+    combined = "combined"
+    jsonl = "jsonl"
+
+
+class EventLoop(str, Enum):
+    auto = "auto"
+    asyncio = "asyncio"
+    uvloop = "uvloop"
 
 
 class FlowError(Exception):
-    pass
+    def __init__(self, message, status_code=None, kind=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.kind = kind
+
+
+@dataclass
+class JsonCodec:
+    name: str
+    dumps: object
+    loads: object
+
+
+json_codec = None
+
+
+def make_json_codec(name=None):
+    if name is not None and name not in JSON_CODECS:
+        raise ValueError(f"Invalid json codec, codec={name}")
+
+    for codec_name in [name] if name else JSON_CODECS:
+        try:
+            module = importlib.import_module(codec_name)
+        except ImportError:
+            continue
+
+        return JSON_CODECS[codec_name](module)
+
+    raise ValueError(f"Invalid json codec, codec={name}")
+
+
+def get_json_codec():
+    global json_codec
+    if json_codec is None:
+        json_codec = make_json_codec()
+
+    return json_codec
+
+
+def preload_modules():
+    for module in RUN_MODULES:
+        module._load()
+
+    get_json_codec()
 
 
 @dataclass
 class Flow:
     duration: float = 0
-    error: FlowError = None
+    error: str = None
     success: bool = True
+    failed_request: str = None
+    error_message: str = None
+
+
+@dataclass
+class StaticBody:
+    compressed_body: bytes
+    size: int
+
+
+@dataclass
+class LogRecord:
+    timestamp: float
+    method: str
+    path: str
+
+
+@dataclass
+class RequestStats:
+    count: int = 0
+    total_time: float = 0
+    buckets: list = field(default_factory=lambda: [0] * (len(LATENCY_BUCKETS) + 1))
+
+    def add(self, duration):
+        self.count += 1
+        self.total_time += duration
+        self.buckets[bisect.bisect_left(LATENCY_BUCKETS, duration)] += 1
+
+
+@dataclass
+class TransferStats:
+    sent_bytes: int = 0
+    sent_decoded_bytes: int = 0
+    received_bytes: int = 0
+    received_decoded_bytes: int = 0
+
+
+@dataclass
+class Metrics:
+    success_flows: int = 0
+    error_flows: int = 0
+    mean_time: float = 0
+    squared_deviations: float = 0
+    errors: dict = field(default_factory=dict)
+    error_samples: list = field(default_factory=list)
+    error_samples_size: int = ERROR_SAMPLES_SIZE
+    requests: dict = field(default_factory=dict)
+    transfers: dict = field(default_factory=dict)
+
+    @property
+    def total_flows(self):
+        return self.success_flows + self.error_flows
+
+    @property
+    def standard_deviation(self):
+        if self.success_flows < 2:
+            return 0
+
+        return math.sqrt(self.squared_deviations / (self.success_flows - 1))
+
+    def add_request(self, name, status, duration):
+        key = (name, status)
+        request_stats = self.requests.get(key)
+        if request_stats is None:
+            request_stats = self.requests[key] = RequestStats()
+
+        request_stats.add(duration)
+
+    def add_transfer(self, name, sent_bytes, sent_decoded_bytes, received_bytes=0, received_decoded_bytes=0):
+        transfer_stats = self.transfers.get(name)
+        if transfer_stats is None:
+            transfer_stats = self.transfers[name] = TransferStats()
+
+        transfer_stats.sent_bytes += sent_bytes
+        transfer_stats.sent_decoded_bytes += sent_decoded_bytes
+        transfer_stats.received_bytes += received_bytes
+        transfer_stats.received_decoded_bytes += received_decoded_bytes
+
+    def add_flow(self, flow):
+        if flow.success:
+            self.add_success_flow(flow)
+        else:
+            self.add_error_flow(flow)
+
+    def add_success_flow(self, flow):
+        self.success_flows += 1
+        delta = flow.duration - self.mean_time
+        self.mean_time += delta / self.success_flows
+        self.squared_deviations += delta * (flow.duration - self.mean_time)
+
+    def add_error_flow(self, flow):
+        self.error_flows += 1
+        key = (flow.failed_request, flow.error)
+        self.errors[key] = self.errors.get(key, 0) + 1
+
+        sample = (flow.failed_request, flow.error, flow.error_message)
+        if len(self.error_samples) < self.error_samples_size:
+            self.error_samples.append(sample)
+            return
+
+        index = random.randrange(self.error_flows)
+        if index < self.error_samples_size:
+            self.error_samples[index] = sample
+
+
+@dataclass
+class GeneratorStats:
+    loop_lag_samples: int = 0
+    loop_lag_total: float = 0
+    loop_lag_max: float = 0
+    cpu_time: float = 0
+    nested_time: float = 0
+    overhead: dict = field(default_factory=lambda: dict.fromkeys(OVERHEAD_CATEGORIES, 0))
+
+    @property
+    def loop_lag_mean(self):
+        if not self.loop_lag_samples:
+            return 0
+
+        return self.loop_lag_total / self.loop_lag_samples
+
+    def add_loop_lag(self, lag):
+        self.loop_lag_samples += 1
+        self.loop_lag_total += lag
+        self.loop_lag_max = max(self.loop_lag_max, lag)
+
+    def reset(self):
+        self.loop_lag_samples = 0
+        self.loop_lag_total = 0
+        self.loop_lag_max = 0
+        self.cpu_time = 0
+        self.nested_time = 0
+        self.overhead = dict.fromkeys(OVERHEAD_CATEGORIES, 0)
+
 
+generator_stats = GeneratorStats()
 
+
+def track_overhead(category):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            parent_nested_time = generator_stats.nested_time
+            generator_stats.nested_time = 0
+            start_time = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed_time = time.perf_counter() - start_time
+                generator_stats.overhead[category] += elapsed_time - generator_stats.nested_time
+                generator_stats.nested_time = parent_nested_time + elapsed_time
+
+        return wrapper
+
+    return decorator
+
+
+@dataclass
+class CachedResult:
+    value: object = None
+    expires_at: float = None
+    pending: object = None
+
+    def expired(self):
+        return self.expires_at is not None and time.time() >= self.expires_at
+
+
+class VirtualUser:
+    __slots__ = ("context", "cookies", "cache", "next_start_time")
+
+    def __init__(self):
+        self.context = {}
+        self.cookies = None
+        self.cache = {}
+        self.next_start_time = 0
+
+    def restore_cookies(self, client):
+        client.cookies = None
+        for cookie in self.cookies or ():
+            client.cookies.jar.set_cookie(cookie)
+
+    def keep_cookies(self, client):
+        self.cookies = tuple(client.cookies.jar) or None
+
+
+@track_overhead(OVERHEAD_OUTPUT)
 def show_request_message(status, name, url):
     message = REQUEST_MESSAGE.format(status, name, url)
     typer.echo(message)
 
 
+@track_overhead(OVERHEAD_OUTPUT)
+def show_request_info(name, result):
+    typer.secho(f"{REQUEST_INFO}: request_name={name}, response={result}")
+
+
+@track_overhead(OVERHEAD_OUTPUT)
+def show_flow_error(exc):
+    typer.secho(f"{FLOW_ERROR}: {exc}")
+
+
+@track_overhead(OVERHEAD_JSON)
+def dump_json(data):
+    return get_json_codec().dumps(data).decode()
+
+
+@track_overhead(OVERHEAD_JSON)
+def encode_json(data):
+    return get_json_codec().dumps(data)
+
+
+@track_overhead(OVERHEAD_JSON)
+def load_json(data):
+    return get_json_codec().loads(data)
+
+
+def get_json_headers(headers=None):
+    headers = dict(headers or {})
+    if not any(name.lower() == "content-type" for name in headers):
+        headers["Content-Type"] = JSON_CONTENT_TYPE
+
+    return headers
+
+
+def encode_request_body(data, headers=None):
+    if data is None or isinstance(data, bytes):
+        return data, headers
+
+    return encode_json(data), get_json_headers(headers)
+
+
+@track_overhead(OVERHEAD_COMPRESSION)
+def compress_body(body, encoding):
+    return COMPRESSIONS[encoding](body)
+
+
+def compress_request_body(body, headers, encoding):
+    if encoding not in COMPRESSIONS:
+        raise ValueError(f"Invalid compress encoding, compress={encoding}")
+
+    headers = dict(headers or {})
+    headers["Content-Encoding"] = encoding
+
+    return compress_body(body, encoding), headers
+
+
+def get_received_bytes(resp):
+    content_length = resp.headers.get("Content-Length")
+    if content_length is None:
+        return len(resp.content)
+
+    return int(content_length)
+
+
+@track_overhead(OVERHEAD_TEMPLATING)
 def replace_with_template(context, data):
     if isinstance(data, dict):
-        data = json.dumps(data)
+        data = dump_json(data)
 
-    template = Template(data)
+    template = jinja2.Template(data)
 
     return template.render(**context)
 
 
-async def make_get_request(url, timeout, params=None, headers=None, *args, **kwargs):
+@asynccontextmanager
+async def open_client(client=None):
+    if client is not None:
+        yield client
+        return
+
+    async with httpx.AsyncClient() as client:
+        yield client
+
+
+def get_status_code(exc):
+    response = getattr(exc, "response", None)
+    if response is None:
+        return None
+
+    return response.status_code
+
+
+def classify_http_exception(exc):
+    if isinstance(exc, httpx.TimeoutException):
+        return ERROR_TIMEOUT
+
+    if isinstance(exc, httpx.NetworkError):
+        return ERROR_CONNECT
+
+    status_code = get_status_code(exc)
+    if status_code is None:
+        return ERROR_HTTP
+
+    return ERROR_HTTP_STATUS.format(status_code // 100)
+
+
+async def make_get_request(url, timeout, params=None, headers=None, client=None, *args, **kwargs):
     try:
-        async with httpx.AsyncClient() as client:
+        async with open_client(client) as client:
             resp = await client.get(url, params=params, timeout=timeout, headers=headers)
             resp.raise_for_status()
-    except HTTP_EXCEPTIONS as exc:
-        raise FlowError(f"An error occurred when make_get_request, exc={exc}")
+    except httpx.HTTPError as exc:
+        raise FlowError(
+            f"An error occurred when make_get_request, exc={exc}",
+            status_code=get_status_code(exc),
+            kind=classify_http_exception(exc),
+        )
 
     return resp
 
 
-async def make_delete_request(url, timeout, params=None, headers=None, *args, **kwargs):
+async def make_delete_request(url, timeout, params=None, headers=None, client=None, *args, **kwargs):
     try:
-        async with httpx.AsyncClient() as client:
+        async with open_client(client) as client:
             resp = await client.delete(url, params=params, timeout=timeout, headers=headers)
             resp.raise_for_status()
-    except HTTP_EXCEPTIONS as exc:
-        raise FlowError(f"An error occurred when make_delete_request, exc={exc}")
+    except httpx.HTTPError as exc:
+        raise FlowError(
+            f"An error occurred when make_delete_request, exc={exc}",
+            status_code=get_status_code(exc),
+            kind=classify_http_exception(exc),
+        )
 
     return resp
 
 
-async def make_put_request(url, data, timeout, headers=None, *args, **kwargs):
+async def make_put_request(url, data, timeout, headers=None, client=None, *args, **kwargs):
+    body, headers = encode_request_body(data, headers)
     try:
-        async with httpx.AsyncClient() as client:
-            resp = await client.put(url, json=data, timeout=timeout, headers=headers)
+        async with open_client(client) as client:
+            resp = await client.put(url, data=body, timeout=timeout, headers=headers)
             resp.raise_for_status()
-    except HTTP_EXCEPTIONS as exc:
-        raise FlowError(f"An error occurred when make_put_request, exc={exc}")
+    except httpx.HTTPError as exc:
+        raise FlowError(
+            f"An error occurred when make_put_request, exc={exc}",
+            status_code=get_status_code(exc),
+            kind=classify_http_exception(exc),
+        )
 
     return resp
 
 
-async def make_patch_request(url, data, timeout, headers=None, *args, **kwargs):
+async def make_patch_request(url, data, timeout, headers=None, client=None, *args, **kwargs):
+    body, headers = encode_request_body(data, headers)
     try:
-        async with httpx.AsyncClient() as client:
-            resp = await client.patch(url, json=data, timeout=timeout, headers=headers)
+        async with open_client(client) as client:
+            resp = await client.patch(url, data=body, timeout=timeout, headers=headers)
             resp.raise_for_status()
-    except HTTP_EXCEPTIONS as exc:
-        raise FlowError(f"An error occurred when make_patch_request, exc={exc}")
+    except httpx.HTTPError as exc:
+        raise FlowError(
+            f"An error occurred when make_patch_request, exc={exc}",
+            status_code=get_status_code(exc),
+            kind=classify_http_exception(exc),
+        )
 
     return resp
 
 
-async def make_post_request(url, data, timeout, headers=None, *args, **kwargs):
+async def make_post_request(url, data, timeout, headers=None, client=None, *args, **kwargs):
+    body, headers = encode_request_body(data, headers)
     try:
-        async with httpx.AsyncClient() as client:
-            resp = await client.post(url, json=data, timeout=timeout, headers=headers)
+        async with open_client(client) as client:
+            resp = await client.post(url, data=body, timeout=timeout, headers=headers)
             resp.raise_for_status()
-    except HTTP_EXCEPTIONS as exc:
-        raise FlowError(f"An error occurred when make_post_request, exc={exc}")
+    except httpx.HTTPError as exc:
+        raise FlowError(
+            f"An error occurred when make_post_request, exc={exc}",
+            status_code=get_status_code(exc),
+            kind=classify_http_exception(exc),
+        )
 
     return resp
 
 
 def check_response_data(request_name, data, expected_data, context):
-    expected_data = json.loads(replace_with_template(context, expected_data))
+    expected_data = load_json(replace_with_template(context, expected_data))
     error_msg = RESPONSE_DATA_CHECK_FAILED_MESSAGE.format(request_name, expected_data, data)
 
     if data != expected_data:
-        raise FlowError(error_msg)
+        raise FlowError(error_msg, kind=ERROR_CHECK_DATA)
 
 
 def check_response_status_code(request_name, status_code, expected_status_code):
@@ -144,9 +656,10 @@ def check_response_status_code(request_name, status_code, expected_status_code):
     )
 
     if status_code != expected_status_code:
-        raise FlowError(error_msg)
+        raise FlowError(error_msg, status_code=status_code, kind=ERROR_CHECK_STATUS_CODE)
 
 
+@track_overhead(OVERHEAD_CHECKS)
 def check_response(request_name, data, status_code, context, response_check=None):
     if response_check.get("data"):
         check_response_data(request_name, data, response_check["data"], context)
@@ -154,15 +667,68 @@ def check_response(request_name, data, status_code, context, response_check=None
         check_response_status_code(request_name, status_code, response_check["status_code"])
 
 
-async def make_request(context, name, url, method, response_check=None, *args, **kwargs):
+async def make_request(
+    context,
+    name,
+    url,
+    method,
+    response_check=None,
+    metrics=None,
+    compress=None,
+    static_body=None,
+    decode_response=True,
+    *args,
+    **kwargs,
+):
     method = method.upper()
     try:
         func = eval(HTTP_METHODS_FUNC_MAPPING[method])
     except KeyError:
-        raise FlowError(f"An error ocurred when make_request, invalid http method={method}")
+        raise FlowError(
+            f"An error ocurred when make_request, invalid http method={method}", kind=ERROR_INVALID_METHOD
+        )
+
+    sent_bytes = sent_decoded_bytes = 0
+    if method in HTTP_METHODS_WITH_BODY and static_body:
+        kwargs["data"] = static_body.compressed_body
+        kwargs["headers"] = {**get_json_headers(kwargs.get("headers")), "Content-Encoding": compress}
+        sent_bytes = len(static_body.compressed_body)
+        sent_decoded_bytes = static_body.size
+    elif method in HTTP_METHODS_WITH_BODY and kwargs.get("data") is not None:
+        kwargs["data"], kwargs["headers"] = encode_request_body(kwargs["data"], kwargs.get("headers"))
+        sent_bytes = sent_decoded_bytes = len(kwargs["data"])
+
+        if compress:
+            kwargs["data"], kwargs["headers"] = compress_request_body(
+                kwargs["data"], kwargs["headers"], compress
+            )
+            sent_bytes = len(kwargs["data"])
+
+    start_time = time.perf_counter()
+    try:
+        resp = await func(url, *args, **kwargs)
+    except FlowError as exc:
+        if metrics:
+            metrics.add_request(name, exc.status_code or exc.kind, time.perf_counter() - start_time)
+            metrics.add_transfer(name, sent_bytes, sent_decoded_bytes)
+        raise
+
+    if metrics:
+        metrics.add_request(name, resp.status_code, time.perf_counter() - start_time)
+        metrics.add_transfer(
+            name, sent_bytes, sent_decoded_bytes, get_received_bytes(resp), len(resp.content)
+        )
+
+    if not decode_response:
+        return None
+
+    data = None
+    if resp.content:
+        try:
+            data = load_json(resp.content)
+        except ValueError as exc:
+            raise FlowError(INVALID_JSON_RESPONSE_MESSAGE.format(name, exc), kind=ERROR_INVALID_JSON)
 
-    resp = await func(url, *args, **kwargs)
-    data = resp.json()
     status_code = resp.status_code
 
     if response_check:
@@ -171,52 +737,181 @@ async def make_request(context, name, url, method, response_check=None, *args, *
     return data
 
 
-def show_metrics(flows, total_time):
-    success_flows = [flow for flow in flows if flow.success]
-    error_flows = [flow for flow in flows if flow.error]
+def show_metrics(metrics, total_time):
     mean_time = 0
     standard_deviation = 0
 
-    if len(success_flows) > 1:
-        mean_time = statistics.mean([flow.duration for flow in success_flows])
-        standard_deviation = statistics.stdev([flow.duration for flow in success_flows])
+    if metrics.success_flows > 1:
+        mean_time = metrics.mean_time
+        standard_deviation = metrics.standard_deviation
 
     row = [
-        len(success_flows),
-        len(error_flows),
-        len(flows),
+        metrics.success_flows,
+        metrics.error_flows,
+        metrics.total_flows,
         SECONDS_MASK.format(round(mean_time, 2)),
         SECONDS_MASK.format(round(standard_deviation, 2)),
         SECONDS_MASK.format(round(total_time, 2)),
     ]
 
     typer.echo("\n")
-    typer.echo(tabulate([row], headers=TABLE_HEADERS))
+    typer.echo(tabulate.tabulate([row], headers=TABLE_HEADERS))
+
+    if metrics.transfers:
+        show_transfers(metrics)
+
+    if metrics.errors:
+        show_errors(metrics)
+
+
+def show_transfers(metrics):
+    rows = [
+        [
+            request_name,
+            transfer_stats.sent_bytes,
+            transfer_stats.sent_decoded_bytes,
+            transfer_stats.received_bytes,
+            transfer_stats.received_decoded_bytes,
+        ]
+        for request_name, transfer_stats in metrics.transfers.items()
+    ]
+
+    typer.echo("\n")
+    typer.echo(tabulate.tabulate(rows, headers=TRANSFER_TABLE_HEADERS))
+
+
+def show_errors(metrics):
+    rows = [
+        [request_name, error, count]
+        for (request_name, error), count in sorted(metrics.errors.items(), key=lambda item: -item[1])
+    ]
+
+    typer.echo("\n")
+    typer.echo(tabulate.tabulate(rows, headers=ERROR_TABLE_HEADERS))
+    typer.echo("\n")
+    typer.echo(ERROR_SAMPLES_TITLE)
+    for request_name, error, message in metrics.error_samples:
+        typer.echo(f"{request_name} ({error}): {message}")
+
+
+def show_generator_stats(stats, total_time):
+    cpu_usage = stats.cpu_time / total_time if total_time else 0
+    loop_lag_mean = MILLISECONDS_MASK.format(stats.loop_lag_mean * 1000)
+    row = [
+        loop_lag_mean,
+        MILLISECONDS_MASK.format(stats.loop_lag_max * 1000),
+        *[SECONDS_MASK.format(round(stats.overhead[category], 2)) for category in OVERHEAD_CATEGORIES],
+        PERCENT_MASK.format(cpu_usage * 100),
+    ]
+
+    typer.echo("\n")
+    typer.echo(tabulate.tabulate([row], headers=GENERATOR_TABLE_HEADERS))
+
+    if stats.loop_lag_mean >= LOOP_LAG_WARNING_THRESHOLD or cpu_usage >= CPU_USAGE_WARNING_THRESHOLD:
+        typer.secho(
+            GENERATOR_OVERHEAD_WARNING.format(loop_lag_mean, PERCENT_MASK.format(cpu_usage * 100)),
+            fg=typer.colors.YELLOW,
+            bold=True,
+        )
 
 
 def from_file(file_path):
     with open(file_path) as f:
         try:
-            data = json.load(f)
-        except json.JSONDecodeError:
+            data = load_json(f.read())
+        except ValueError:
             raise ValueError(f"Invalid json file, file={file_path}")
 
         return data
 
 
-def generate_request_data(context, data):
+def load_request_data(data):
     if data.get("from_file"):
-        data = from_file(data.get("from_file"))
+        return from_file(data.get("from_file"))
 
-    return json.loads(replace_with_template(context, data))
+    return data
+
+
+def is_static_template(data):
+    if isinstance(data, dict):
+        data = dump_json(data)
+
+    return not any(marker in data for marker in TEMPLATE_MARKERS)
+
+
+def make_static_body(request):
+    if not request.get("compress") or not request.get("data"):
+        return None
+
+    data = load_request_data(request["data"])
+    if not is_static_template(data):
+        return None
+
+    body = encode_json(data)
+
+    return StaticBody(compress_body(body, request["compress"]), len(body))
+
+
+def prepare_static_bodies(toml_data):
+    requests = []
+    for request in toml_data.get("request", []):
+        static_body = make_static_body(request)
+        requests.append(dict(request, static_body=static_body) if static_body else request)
+
+    return dict(toml_data, request=requests)
+
+
+def generate_request_data(context, data):
+    return load_json(replace_with_template(context, load_request_data(data)))
 
 
 def generate_request_headers(context, headers):
-    return json.loads(replace_with_template(context, headers))
+    return load_json(replace_with_template(context, headers))
 
 
 def generate_request_params(context, params):
-    return json.loads(replace_with_template(context, params))
+    return load_json(replace_with_template(context, params))
+
+
+def get_think_time(think_time):
+    if not isinstance(think_time, dict):
+        return think_time
+
+    distribution = think_time.get("distribution", "fixed")
+    try:
+        func = THINK_TIME_DISTRIBUTIONS[distribution]
+    except KeyError:
+        raise ValueError(f"Invalid think_time distribution, distribution={distribution}")
+
+    return max(func(think_time), 0)
+
+
+def validate_think_time(think_time):
+    if not isinstance(think_time, dict):
+        if not isinstance(think_time, (int, float)):
+            raise ValueError(f"Invalid think_time, think_time={think_time}")
+        return
+
+    distribution = think_time.get("distribution", "fixed")
+    if distribution not in THINK_TIME_DISTRIBUTIONS:
+        raise ValueError(f"Invalid think_time distribution, distribution={distribution}")
+
+    for parameter in THINK_TIME_PARAMETERS[distribution]:
+        if not isinstance(think_time.get(parameter), (int, float)):
+            raise ValueError(f"Invalid think_time {parameter}, distribution={distribution}")
+
+    if distribution == "exponential" and think_time["mean"] <= 0:
+        raise ValueError(f"Invalid think_time mean, mean={think_time['mean']}")
+
+
+async def wait(seconds):
+    if seconds <= 0:
+        return 0
+
+    start_time = time.time()
+    await asyncio.sleep(seconds)
+
+    return time.time() - start_time
 
 
 def make_api_context(api_info):
@@ -231,50 +926,299 @@ def make_api_context(api_info):
     return context
 
 
-async def run_flow(toml_data, verbose):
-    flow_config = copy.deepcopy(toml_data)
-    context = make_api_context(flow_config.get("api")) or {}
-    start_flow_time = time.time()
-    current_flow = Flow()
+def prepare_request(context, request):
+    request = dict(request)
+    request["timeout"] = request.get("timeout") or DEFAULT_TIMEOUT
+    request["url"] = replace_with_template(context, request["url"])
+
+    if request.get("static_body"):
+        request.pop("data", None)
+    elif request.get("data"):
+        request["data"] = generate_request_data(context, request["data"])
+
+    if request.get("params"):
+        request["params"] = generate_request_params(context, request["params"])
+
+    if request.get("headers"):
+        request["headers"] = generate_request_headers(context, request["headers"])
+
+    return request
 
-    for request in flow_config["request"]:
-        request["timeout"] = request.get("timeout") or DEFAULT_TIMEOUT
-        request["url"] = replace_with_template(context, request["url"])
 
-        if request.get("data"):
-            request["data"] = generate_request_data(context, request["data"])
+async def send_request(context, request, verbose):
+    request = prepare_request(context, request)
+
+    try:
+        result = await make_request(context, **request)
+    except FlowError as exc:
+        show_request_message(ERROR, request["name"], request["url"])
+        if verbose:
+            show_flow_error(exc)
+        raise
+
+    show_request_message(SUCCESS, request["name"], request["url"])
+    if verbose:
+        show_request_info(request["name"], result)
+
+    return result
+
+
+def get_cache_config(request):
+    cache_config = request.get("cache_result")
+    if not cache_config:
+        return None
+
+    if not isinstance(cache_config, dict):
+        cache_config = {}
+
+    scope = cache_config.get("scope", DEFAULT_CACHE_SCOPE)
+    if scope not in CACHE_SCOPES:
+        raise ValueError(f"Invalid cache_result scope, scope={scope}")
+
+    ttl = cache_config.get("ttl")
+    if ttl is not None and not isinstance(ttl, (int, float)):
+        raise ValueError(f"Invalid cache_result ttl, ttl={ttl}")
+
+    return {"scope": scope, "ttl": ttl}
+
+
+async def get_cached_result(caches, cache_config, name):
+    cache = caches[cache_config["scope"]]
+    cached_result = cache.get(name)
+    while cached_result is not None and cached_result.pending is not None:
+        await asyncio.shield(cached_result.pending)
+        cached_result = cache.get(name)
+
+    if cached_result is None or cached_result.expired():
+        return None
+
+    return cached_result
+
+
+async def fetch_cached_result(caches, cache_config, name, fetch):
+    cached_result = await get_cached_result(caches, cache_config, name)
+    if cached_result:
+        return cached_result.value, True
+
+    cache = caches[cache_config["scope"]]
+    pending = asyncio.get_event_loop().create_future()
+    cache[name] = CachedResult(pending=pending)
+    try:
+        value = await fetch()
+    except BaseException:
+        cache.pop(name, None)
+        raise
+    else:
+        save_cached_result(caches, cache_config, name, value)
+    finally:
+        pending.set_result(None)
+
+    return value, False
+
+
+def invalidate_cached_result(caches, cache_config, name, value):
+    cache = caches[cache_config["scope"]]
+    cached_result = cache.get(name)
+    if cached_result is not None and cached_result.pending is None and cached_result.value is value:
+        del cache[name]
+
+
+def save_cached_result(caches, cache_config, name, value):
+    expires_at = None
+    if cache_config["ttl"]:
+        expires_at = time.time() + cache_config["ttl"]
+
+    caches[cache_config["scope"]][name] = CachedResult(value=value, expires_at=expires_at)
 
-        if request.get("params"):
-            request["params"] = generate_request_params(context, request["params"])
 
-        if request.get("headers"):
-            request["headers"] = generate_request_headers(context, request["headers"])
+def make_caches():
+    return {scope: {} for scope in CACHE_SCOPES}
+
+
+async def refresh_cached_results(context, caches, cached_requests, verbose):
+    while cached_requests:
+        request = cached_requests.pop(0)
+        cache_config = get_cache_config(request)
+        invalidate_cached_result(caches, cache_config, request["name"], context.get(request["name"]))
+
+        context[request["name"]], _ = await fetch_cached_result(
+            caches, cache_config, request["name"], functools.partial(send_request, context, request, verbose)
+        )
+
+
+async def run_request(context, request, verbose, caches, cached_requests):
+    try:
+        return await send_request(context, request, verbose)
+    except FlowError as exc:
+        if exc.status_code != HTTP_UNAUTHORIZED or not cached_requests:
+            raise
+
+    await refresh_cached_results(context, caches, cached_requests, verbose)
+
+    return await send_request(context, request, verbose)
+
+
+async def run_flow(toml_data, verbose, caches=None, client=None, virtual_user=None, metrics=None):
+    context = make_api_context(toml_data.get("api")) or {}
+    if virtual_user:
+        context.update(virtual_user.context)
+
+    caches = caches or make_caches()
+    cached_requests = []
+    pacing = toml_data["configs"].get("pacing", 0)
+    waiting_time = 0
+    start_flow_time = time.time()
+    current_flow = Flow()
+
+    for request in toml_data["request"]:
+        if client or metrics:
+            request = dict(request, client=client, metrics=metrics)
+
+        cache_config = get_cache_config(request)
+        fetch = functools.partial(run_request, context, request, verbose, caches, cached_requests)
 
         try:
-            result = await make_request(context, **request)
-            show_request_message(SUCCESS, request["name"], request["url"])
-            if verbose:
-                typer.secho(f"{REQUEST_INFO}: request_name={request['name']}, response={result}")
+            if cache_config:
+                result, cached = await fetch_cached_result(caches, cache_config, request["name"], fetch)
+                if cached:
+                    context[request["name"]] = result
+                    cached_requests.append(request)
+                    continue
+            else:
+                result = await fetch()
         except FlowError as exc:
-            show_request_message(ERROR, request["name"], request["url"])
-            current_flow.error = exc
+            current_flow.error = exc.kind
+            current_flow.error_message = str(exc)
+            current_flow.failed_request = request["name"]
             current_flow.success = False
-            if verbose:
-                typer.secho(f"{FLOW_ERROR}: {exc}")
             break
 
-        if request.get("save_result"):
+        if request.get("save_result") or cache_config:
             context[request["name"]] = result
 
-    current_flow.duration = time.time() - start_flow_time
+        if request.get("save_result") and virtual_user:
+            virtual_user.context[request["name"]] = result
+
+        if request.get("think_time"):
+            waiting_time += await wait(get_think_time(request["think_time"]))
+
+    elapsed_time = time.time() - start_flow_time
+    current_flow.duration = elapsed_time - waiting_time
+
+    if virtual_user:
+        virtual_user.next_start_time = start_flow_time + pacing
+    else:
+        await wait(pacing - elapsed_time)
 
     return current_flow
 
 
-async def start(toml_data, verbose):
-    flows = tuple()
+async def probe_event_loop_lag(stats, interval=LOOP_LAG_PROBE_INTERVAL):
+    loop = asyncio.get_event_loop()
+    while True:
+        expected_time = loop.time() + interval
+        await asyncio.sleep(interval)
+        stats.add_loop_lag(max(loop.time() - expected_time, 0))
+
+
+async def run_worker(
+    toml_data, verbose, virtual_users, run_cache, end_time, metrics, warmup_end_time=0, stopping=None
+):
+    worker_cache = {}
+
+    async with httpx.AsyncClient() as client:
+        for virtual_user in itertools.cycle(virtual_users):
+            await wait(min(virtual_user.next_start_time, end_time) - time.time())
+            if time.time() >= end_time or (stopping and stopping.is_set()):
+                break
+
+            flow_metrics = metrics if time.time() >= warmup_end_time else None
+            caches = {"run": run_cache, "worker": worker_cache, "virtual_user": virtual_user.cache}
+            virtual_user.restore_cookies(client)
+            flow = await run_flow(toml_data, verbose, caches, client, virtual_user, flow_metrics)
+            virtual_user.keep_cookies(client)
+
+            if flow_metrics:
+                flow_metrics.add_flow(flow)
+
+
+def install_signal_handlers(stop):
+    loop = asyncio.get_event_loop()
+    installed_signals = []
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(signum, stop)
+        except (NotImplementedError, RuntimeError):
+            continue
+
+        installed_signals.append(signum)
+
+    return installed_signals
+
+
+def remove_signal_handlers(installed_signals):
+    loop = asyncio.get_event_loop()
+    for signum in installed_signals:
+        loop.remove_signal_handler(signum)
+
+
+async def cancel_workers_after_stop(stopping, workers, shutdown_timeout):
+    await stopping.wait()
+    typer.secho(STOP_MESSAGE.format(shutdown_timeout), fg=typer.colors.YELLOW, bold=True)
+
+    await asyncio.wait(workers, timeout=shutdown_timeout)
+    for worker in workers:
+        worker.cancel()
+
+
+def validate_configs(configs):
+    for name in REQUIRED_CONFIGS:
+        if name not in configs:
+            raise ValueError(f"Missing config, {name} is required")
+
+    for name in POSITIVE_INTEGER_CONFIGS:
+        value = configs.get(name, 1)
+        if not isinstance(value, int) or isinstance(value, bool) or value <= 0:
+            raise ValueError(f"Invalid {name}, {name}={value}")
+
+    for name in NON_NEGATIVE_NUMBER_CONFIGS:
+        value = configs.get(name, 0)
+        if not isinstance(value, (int, float)) or isinstance(value, bool) or value < 0:
+            raise ValueError(f"Invalid {name}, {name}={value}")
+
+
+def validate_flow_config(toml_data):
+    validate_configs(toml_data.get("configs", {}))
+
+    for request in toml_data.get("request", []):
+        if request.get("think_time") is not None:
+            validate_think_time(request["think_time"])
+
+        if request.get("compress") and request["compress"] not in COMPRESSIONS:
+            raise ValueError(f"Invalid compress encoding, compress={request['compress']}")
+
+        get_cache_config(request)
+
+
+async def start(toml_data, verbose, metrics_port=None, metrics_host=DEFAULT_METRICS_HOST):
+    validate_flow_config(toml_data)
+    toml_data = prepare_static_bodies(toml_data)
+
     duration = toml_data["configs"]["duration"]
+    warmup = toml_data["configs"].get("warmup", 0)
+    shutdown_timeout = toml_data["configs"].get("shutdown_timeout", DEFAULT_SHUTDOWN_TIMEOUT)
     number_of_concurrent_flows = toml_data["configs"]["number_of_concurrent_flows"]
+    number_of_virtual_users = toml_data["configs"].get("virtual_users", number_of_concurrent_flows)
+
+    if number_of_virtual_users < number_of_concurrent_flows:
+        typer.secho(
+            VIRTUAL_USERS_WARNING.format(
+                number_of_virtual_users, number_of_concurrent_flows, number_of_virtual_users
+            ),
+            fg=typer.colors.YELLOW,
+            bold=True,
+        )
+        number_of_concurrent_flows = number_of_virtual_users
 
     typer.secho(
         START_MESSAGE.format(number_of_concurrent_flows, duration),
@@ -282,31 +1226,487 @@ async def start(toml_data, verbose):
         underline=True,
         bold=True,
     )
+    if warmup:
+        typer.secho(WARMUP_MESSAGE.format(warmup), fg=typer.colors.CYAN)
 
+    run_cache = {}
+    metrics = Metrics()
+    virtual_users = [VirtualUser() for _ in range(number_of_virtual_users)]
+
+    metrics_server = None
+    if metrics_port:
+        metrics_server = await serve_metrics(metrics, metrics_port, metrics_host)
+
+    preload_modules()
+    generator_stats.reset()
+    probe = asyncio.ensure_future(probe_event_loop_lag(generator_stats))
+    start_cpu_time = time.process_time()
     start_time = time.time()
-    while True:
-        elapsed_seconds = time.time() - start_time
+    warmup_end_time = start_time + warmup
+    end_time = warmup_end_time + duration
+    stopping = asyncio.Event()
+    workers = [
+        asyncio.ensure_future(
+            run_worker(
+                toml_data,
+                verbose,
+                virtual_users[worker::number_of_concurrent_flows],
+                run_cache,
+                end_time,
+                metrics,
+                warmup_end_time,
+                stopping,
+            )
+        )
+        for worker in range(number_of_concurrent_flows)
+    ]
+
+    def stop():
+        if stopping.is_set():
+            for worker in workers:
+                worker.cancel()
+
+        stopping.set()
+
+    installed_signals = install_signal_handlers(stop)
+    watcher = asyncio.ensure_future(cancel_workers_after_stop(stopping, workers, shutdown_timeout))
+
+    try:
+        await asyncio.wait(workers, return_when=asyncio.FIRST_EXCEPTION)
+        for worker in workers:
+            if worker.done() and not worker.cancelled():
+                worker.result()
+    finally:
+        for task in (*workers, watcher, probe):
+            task.cancel()
+        await asyncio.wait([*workers, watcher, probe])
+
+        remove_signal_handlers(installed_signals)
+
+        end_run_time = time.time()
+        elapsed_seconds = max(end_run_time - warmup_end_time, 0)
+        generator_stats.cpu_time = time.process_time() - start_cpu_time
+
+        if metrics_server:
+            metrics_server.close()
+            await metrics_server.wait_closed()
+
+        show_metrics(metrics, elapsed_seconds)
+        show_generator_stats(generator_stats, end_run_time - start_time)
+
+    return metrics
+
+
+def parse_log_timestamp(value):
+    if isinstance(value, (int, float)):
+        return float(value)
+
+    return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+
+
+def parse_jsonl_log_line(line):
+    try:
+        entry = load_json(line)
+        url = urlsplit(entry.get("path") or entry["url"])
+        timestamp = parse_log_timestamp(entry.get("timestamp", entry.get("time")))
+    except (ValueError, KeyError, TypeError, AttributeError):
+        return None
+
+    path = url.path + (f"?{url.query}" if url.query else "")
+
+    return LogRecord(timestamp=timestamp, method=entry.get("method", "GET").upper(), path=path)
+
 
-        if elapsed_seconds >= duration:
+def parse_access_log_line(line):
+    match = ACCESS_LOG_PATTERN.match(line)
+    if not match:
+        return None
+
+    try:
+        timestamp = datetime.strptime(match.group("time"), ACCESS_LOG_TIME_FORMAT).timestamp()
+    except ValueError:
+        return None
+
+    return LogRecord(timestamp=timestamp, method=match.group("method"), path=match.group("path"))
+
+
+def parse_log_line(line, log_format=LogFormat.auto):
+    line = line.strip()
+    if not line:
+        return None
+
+    if log_format == LogFormat.jsonl or (log_format == LogFormat.auto and line.startswith("{")):
+        return parse_jsonl_log_line(line)
+
+    return parse_access_log_line(line)
+
+
+def read_log_lines(log_file):
+    with open(log_file, encoding="utf-8", errors="replace") as f:
+        yield from f
+
+
+def map_log_path(api_info, path):
+    for api in sorted(api_info, key=lambda api: len(api.get("path_prefix", "")), reverse=True):
+        if path.startswith(api.get("path_prefix", "")):
+            return api["name"], api["base_url"].rstrip("/") + path
+
+    return None, None
+
+
+async def replay_request(client, name, method, url, timeout, metrics, verbose):
+    start_time = time.perf_counter()
+    current_flow = Flow()
+
+    try:
+        await make_request(
+            {},
+            name,
+            url,
+            method,
+            metrics=metrics,
+            decode_response=False,
+            data=None,
+            timeout=timeout,
+            client=client,
+        )
+    except FlowError as exc:
+        current_flow.success = False
+        current_flow.failed_request = name
+        current_flow.error = exc.kind
+        current_flow.error_message = str(exc)
+
+    current_flow.duration = time.perf_counter() - start_time
+    metrics.add_flow(current_flow)
+
+    show_request_message(SUCCESS if current_flow.success else ERROR, name, url)
+    if verbose and not current_flow.success:
+        show_flow_error(current_flow.error_message)
+
+
+async def replay(
+    toml_data,
+    log_file,
+    log_format,
+    speed,
+    max_in_flight,
+    timeout,
+    verbose,
+    metrics_port=None,
+    metrics_host=DEFAULT_METRICS_HOST,
+):
+    loop = asyncio.get_event_loop()
+    api_info = toml_data.get("api", [])
+    metrics = Metrics()
+    semaphore = asyncio.Semaphore(max_in_flight)
+    pending = set()
+    first_timestamp = None
+    invalid_lines = 0
+    unmapped_lines = 0
+
+    typer.secho(
+        REPLAY_START_MESSAGE.format(log_file, speed, max_in_flight),
+        fg=typer.colors.CYAN,
+        underline=True,
+        bold=True,
+    )
+
+    metrics_server = None
+    if metrics_port:
+        metrics_server = await serve_metrics(metrics, metrics_port, metrics_host)
+
+    preload_modules()
+
+    async def send(name, method, url):
+        try:
+            await replay_request(client, name, method, url, timeout, metrics, verbose)
+        finally:
+            semaphore.release()
+
+    start_time = loop.time()
+    async with httpx.AsyncClient() as client:
+        for line in read_log_lines(log_file):
+            record = parse_log_line(line, log_format)
+            if record is None:
+                invalid_lines += 1
+                continue
+
+            api_name, url = map_log_path(api_info, record.path)
+            if url is None:
+                unmapped_lines += 1
+                continue
+
+            if first_timestamp is None:
+                first_timestamp = record.timestamp
+
+            await wait(start_time + (record.timestamp - first_timestamp) / speed - loop.time())
+            await semaphore.acquire()
+
+            task = asyncio.ensure_future(send(f"{record.method} {api_name}", record.method, url))
+            pending.add(task)
+            task.add_done_callback(pending.discard)
+
+        if pending:
+            await asyncio.wait(pending)
+
+    elapsed_seconds = loop.time() - start_time
+
+    if metrics_server:
+        metrics_server.close()
+        await metrics_server.wait_closed()
+
+    show_metrics(metrics, elapsed_seconds)
+    if invalid_lines or unmapped_lines:
+        typer.echo(REPLAY_SKIPPED_MESSAGE.format(invalid_lines, unmapped_lines))
+
+    return metrics
+
+
+async def read_http_request(reader):
+    request_line = await reader.readline()
+    if not request_line:
+        return None
+
+    content_length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
             break
 
-        results = await asyncio.gather(
-            *[run_flow(toml_data, verbose) for _ in range(number_of_concurrent_flows)]
+        name, _, value = line.decode("latin-1").partition(":")
+        if name.strip().lower() == "content-length":
+            content_length = int(value)
+
+    await reader.readexactly(content_length)
+
+    return request_line
+
+
+def escape_label_value(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def render_prometheus_metrics(metrics):
+    lines = [
+        "# HELP bloodaxe_flows_total Finished flows by result.",
+        "# TYPE bloodaxe_flows_total counter",
+        f'bloodaxe_flows_total{{result="success"}} {metrics.success_flows}',
+        f'bloodaxe_flows_total{{result="error"}} {metrics.error_flows}',
+        "# HELP bloodaxe_flow_errors_total Failed flows by request and error.",
+        "# TYPE bloodaxe_flow_errors_total counter",
+    ]
+
+    for (request_name, error), count in metrics.errors.items():
+        labels = f'request="{escape_label_value(request_name)}",error="{escape_label_value(error)}"'
+        lines.append(f"bloodaxe_flow_errors_total{{{labels}}} {count}")
+
+    lines.append("# HELP bloodaxe_request_bytes_total Request body bytes sent by request and encoding.")
+    lines.append("# TYPE bloodaxe_request_bytes_total counter")
+
+    for request_name, transfer_stats in metrics.transfers.items():
+        label = f'request="{escape_label_value(request_name)}"'
+        lines.append(f'bloodaxe_request_bytes_total{{{label},encoding="wire"}} {transfer_stats.sent_bytes}')
+        lines.append(
+            f'bloodaxe_request_bytes_total{{{label},encoding="decoded"}} {transfer_stats.sent_decoded_bytes}'
         )
 
-        flows += tuple(results)
+    lines.append("# HELP bloodaxe_response_bytes_total Response body bytes received by request and encoding.")
+    lines.append("# TYPE bloodaxe_response_bytes_total counter")
+
+    for request_name, transfer_stats in metrics.transfers.items():
+        label = f'request="{escape_label_value(request_name)}"'
+        received_bytes = transfer_stats.received_bytes
+        received_decoded_bytes = transfer_stats.received_decoded_bytes
+        lines.append(f'bloodaxe_response_bytes_total{{{label},encoding="wire"}} {received_bytes}')
+        lines.append(f'bloodaxe_response_bytes_total{{{label},encoding="decoded"}} {received_decoded_bytes}')
+
+    lines.append("# HELP bloodaxe_request_duration_seconds Request latency by request and status.")
+    lines.append("# TYPE bloodaxe_request_duration_seconds histogram")
+
+    for (request_name, status), request_stats in metrics.requests.items():
+        labels = f'request="{escape_label_value(request_name)}",status="{escape_label_value(status)}"'
+        cumulative_count = 0
+        for bucket, count in zip(LATENCY_BUCKETS, request_stats.buckets):
+            cumulative_count += count
+            lines.append(
+                f'bloodaxe_request_duration_seconds_bucket{{{labels},le="{bucket}"}} {cumulative_count}'
+            )
+
+        lines.append(f'bloodaxe_request_duration_seconds_bucket{{{labels},le="+Inf"}} {request_stats.count}')
+        lines.append(f"bloodaxe_request_duration_seconds_sum{{{labels}}} {request_stats.total_time}")
+        lines.append(f"bloodaxe_request_duration_seconds_count{{{labels}}} {request_stats.count}")
 
-    show_metrics(flows, elapsed_seconds)
+    return "\n".join(lines) + "\n"
 
 
-@app.command()
-def main(flow_config_file: Path, verbose: bool = False):
+async def start_metrics_server(metrics, port, host=DEFAULT_METRICS_HOST):
+    async def handle_connection(reader, writer):
+        try:
+            if await read_http_request(reader):
+                body = render_prometheus_metrics(metrics).encode()
+                writer.write(METRICS_RESPONSE.format(len(body)).encode() + body)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle_connection, host, port)
+
+
+async def serve_metrics(metrics, port, host=DEFAULT_METRICS_HOST):
+    try:
+        metrics_server = await start_metrics_server(metrics, port, host)
+    except OSError as exc:
+        typer.secho(
+            METRICS_SERVER_ERROR_MESSAGE.format(host, port, exc.strerror or exc),
+            fg=typer.colors.RED,
+            bold=True,
+        )
+        raise typer.Exit(code=1)
+
+    typer.echo(METRICS_SERVER_MESSAGE.format(host, port))
+
+    return metrics_server
+
+
+class StubServer:
+    def __init__(self, host="127.0.0.1", port=0, latency=0, payload_size=0, error_rate=0):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.error_rate = error_rate
+        self.body = encode_json({"payload": "x" * payload_size})
+        self.number_of_requests = 0
+        self.server = None
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}"
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle_connection, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.stop()
+
+    def make_response(self):
+        status_code = 200
+        if self.error_rate and random.random() < self.error_rate:
+            status_code = 500
+
+        head = STUB_RESPONSE.format(status_code, STUB_STATUS[status_code], len(self.body))
+
+        return head.encode() + self.body
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while await read_http_request(reader):
+                self.number_of_requests += 1
+                if self.latency:
+                    await asyncio.sleep(self.latency)
+
+                writer.write(self.make_response())
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+
+def set_event_loop_policy(loop):
+    if loop == EventLoop.asyncio:
+        return True
+
+    try:
+        uvloop = importlib.import_module("uvloop")
+    except ImportError:
+        return loop == EventLoop.auto
+
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+
+    return True
+
+
+def validate_speed(value):
+    if value <= 0:
+        raise typer.BadParameter("speed must be greater than 0")
+
+    return value
+
+
+@app.command(DEFAULT_COMMAND)
+def main(
+    flow_config_file: Path,
+    verbose: bool = False,
+    loop: EventLoop = EventLoop.auto,
+    metrics_port: int = None,
+    metrics_host: str = DEFAULT_METRICS_HOST,
+):
     try:
         toml_data = toml.load(flow_config_file)
     except (TypeError, toml.TomlDecodeError):
         typer.echo("Invalid toml file")
-    else:
-        asyncio.run(start(toml_data, verbose))
+        return
+
+    if not set_event_loop_policy(loop):
+        typer.echo(UVLOOP_NOT_INSTALLED_MESSAGE)
+        raise typer.Exit(code=1)
+
+    try:
+        validate_flow_config(toml_data)
+    except ValueError as exc:
+        typer.echo(str(exc))
+        raise typer.Exit(code=1)
+
+    asyncio.run(start(toml_data, verbose, metrics_port=metrics_port, metrics_host=metrics_host))
+
+
+@app.command("replay")
+def replay_command(
+    flow_config_file: Path,
+    log_file: Path = typer.Argument(..., exists=True, dir_okay=False),
+    log_format: LogFormat = LogFormat.auto,
+    speed: float = typer.Option(1.0, callback=validate_speed),
+    max_in_flight: int = typer.Option(1000, min=1),
+    timeout: float = DEFAULT_TIMEOUT,
+    verbose: bool = False,
+    loop: EventLoop = EventLoop.auto,
+    metrics_port: int = None,
+    metrics_host: str = DEFAULT_METRICS_HOST,
+):
+    try:
+        toml_data = toml.load(flow_config_file)
+    except (TypeError, toml.TomlDecodeError):
+        typer.echo("Invalid toml file")
+        return
+
+    if not set_event_loop_policy(loop):
+        typer.echo(UVLOOP_NOT_INSTALLED_MESSAGE)
+        raise typer.Exit(code=1)
+
+    asyncio.run(
+        replay(
+            toml_data,
+            log_file,
+            log_format,
+            speed,
+            max_in_flight,
+            timeout,
+            verbose,
+            metrics_port=metrics_port,
+            metrics_host=metrics_host,
+        )
+    )
 
 
 if __name__ == "__main__":
@@ -1,6 +1,9 @@
+import socket
+
+import httpx
 import pytest
 
-from bloodaxe import Flow, FlowError
+from bloodaxe import ERROR_HTTP_STATUS, Flow, Metrics
 
 
 @pytest.fixture
@@ -10,10 +13,25 @@ def flows():
         Flow(duration=2.0, error=None, success=True),
         Flow(duration=3.0, error=None, success=True),
         Flow(duration=4.0, error=None, success=True),
-        Flow(duration=5.0, error=FlowError("teste error"), success=False),
+        Flow(
+            duration=5.0,
+            error=ERROR_HTTP_STATUS.format(5),
+            success=False,
+            failed_request="get_user",
+            error_message="teste error",
+        ),
     )
 
 
+@pytest.fixture
+def metrics(flows):
+    metrics = Metrics()
+    for flow in flows:
+        metrics.add_flow(flow)
+
+    return metrics
+
+
 @pytest.fixture
 def toml_data():
     return {
@@ -137,3 +155,41 @@ def post_user_response(get_user_response):
         "lastname": f"{get_user_response['lastname']} test",
         "status": f"{get_user_response['status']} test",
     }
+
+
+@pytest.fixture
+def cached_token_requests():
+    return [
+        {
+            "name": "get_token",
+            "url": "{{ user_api.base_url }}/token/",
+            "method": "POST",
+            "data": {"grant_type": "client_credentials"},
+            "cache_result": {"scope": "run", "ttl": 3600},
+        },
+        {
+            "name": "get_user",
+            "url": "{{ user_api.base_url }}/users/1",
+            "method": "GET",
+            "headers": {"X-Auth-Token": "{{ get_token.access_token }}"},
+        },
+    ]
+
+
+@pytest.fixture
+def unused_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture(params=[httpx.HTTPError, httpx.NetworkError, httpx.ReadTimeout, httpx.ConnectTimeout])
+def http_exception(request):
+    return request.param
+
+
+@pytest.fixture
+def access_log(tmp_path):
+    log_file = tmp_path / "access.log"
+    log_file.write_text('127.0.0.1 - - [10/Oct/2000:13:55:36 -0700] "GET /users/1 HTTP/1.1" 200 2326\n')
+    return log_file
@@ -1,43 +1,126 @@
+import asyncio
+import gzip
+import importlib
+import itertools
 import json
+import os
+import signal
+import socket
 import statistics
-from unittest.mock import patch
+import subprocess
+import sys
+import time
+import zlib
+from unittest.mock import Mock, patch
 
 import asynctest
+import httpx
+import jinja2
 import pytest
 import toml
 import typer
 from tabulate import tabulate
+from typer.testing import CliRunner
+from werkzeug import Response
 
+import bloodaxe
 from bloodaxe import (
+    DEFAULT_METRICS_HOST,
     DEFAULT_TIMEOUT,
-    HTTP_EXCEPTIONS,
+    ERROR_CHECK_DATA,
+    ERROR_CHECK_STATUS_CODE,
+    ERROR_CONNECT,
+    ERROR_HTTP,
+    ERROR_HTTP_STATUS,
+    ERROR_INVALID_JSON,
+    ERROR_SAMPLES_TITLE,
+    ERROR_TABLE_HEADERS,
+    ERROR_TIMEOUT,
+    GENERATOR_OVERHEAD_WARNING,
+    GENERATOR_TABLE_HEADERS,
+    JSON_CODECS,
+    JSON_CONTENT_TYPE,
+    LATENCY_BUCKETS,
+    METRICS_SERVER_ERROR_MESSAGE,
+    METRICS_SERVER_MESSAGE,
+    OVERHEAD_CHECKS,
+    OVERHEAD_JSON,
+    OVERHEAD_OUTPUT,
+    OVERHEAD_TEMPLATING,
+    REPLAY_SKIPPED_MESSAGE,
     REQUEST_MESSAGE,
     RESPONSE_DATA_CHECK_FAILED_MESSAGE,
     RESPONSE_STATUS_CODE_CHECK_FAILED_MESSAGE,
     SECONDS_MASK,
     START_MESSAGE,
+    STOP_MESSAGE,
     TABLE_HEADERS,
+    TRANSFER_TABLE_HEADERS,
+    UVLOOP_NOT_INSTALLED_MESSAGE,
+    VIRTUAL_USERS_WARNING,
+    WARMUP_MESSAGE,
+    CachedResult,
+    EventLoop,
+    Flow,
     FlowError,
+    GeneratorStats,
+    LazyModule,
+    LogFormat,
+    LogRecord,
+    Metrics,
+    RequestStats,
+    StaticBody,
+    StubServer,
+    VirtualUser,
+    app,
     check_response,
     check_response_data,
     check_response_status_code,
+    classify_http_exception,
+    compress_request_body,
+    encode_json,
+    encode_request_body,
     from_file,
     generate_request_data,
     generate_request_headers,
     generate_request_params,
+    generator_stats,
+    get_cache_config,
+    get_think_time,
+    is_static_template,
     main,
     make_api_context,
+    make_caches,
     make_delete_request,
     make_get_request,
+    make_json_codec,
     make_patch_request,
     make_post_request,
     make_put_request,
     make_request,
+    make_static_body,
+    map_log_path,
+    parse_log_line,
+    preload_modules,
+    prepare_request,
+    prepare_static_bodies,
+    probe_event_loop_lag,
+    read_log_lines,
+    render_prometheus_metrics,
     replace_with_template,
+    replay,
     run_flow,
+    run_worker,
+    set_event_loop_policy,
+    show_generator_stats,
     show_metrics,
     show_request_message,
+    show_transfers,
     start,
+    start_metrics_server,
+    track_overhead,
+    validate_flow_config,
+    validate_think_time,
 )
 
 
@@ -68,10 +151,9 @@ async def test_make_get_request(httpserver, response):
 
 @pytest.mark.asyncio
 @asynctest.patch("bloodaxe.httpx.AsyncClient")
-@pytest.mark.parametrize("exception", [(exception,) for exception in HTTP_EXCEPTIONS])
-async def test_make_get_request_raise_flow_error(mocked_httpx_client, flow_url, exception):
+async def test_make_get_request_raise_flow_error(mocked_httpx_client, flow_url, http_exception):
     mocked_httpx_client.return_value.__aenter__.return_value.get = asynctest.CoroutineMock(
-        side_effect=exception
+        side_effect=http_exception
     )
 
     params = {"name": "Ivy"}
@@ -97,10 +179,9 @@ async def test_make_delete_request(httpserver, response):
 
 @pytest.mark.asyncio
 @asynctest.patch("bloodaxe.httpx.AsyncClient")
-@pytest.mark.parametrize("exception", [(exception,) for exception in HTTP_EXCEPTIONS])
-async def test_make_delete_request_raise_flow_error(mocked_httpx_client, flow_url, exception):
+async def test_make_delete_request_raise_flow_error(mocked_httpx_client, flow_url, http_exception):
     mocked_httpx_client.return_value.__aenter__.return_value.delete = asynctest.CoroutineMock(
-        side_effect=exception
+        side_effect=http_exception
     )
 
     params = {"name": "Ivy"}
@@ -126,10 +207,9 @@ async def test_make_post_request(httpserver, response):
 
 @pytest.mark.asyncio
 @asynctest.patch("bloodaxe.httpx.AsyncClient")
-@pytest.mark.parametrize("exception", [(exception,) for exception in HTTP_EXCEPTIONS])
-async def test_make_post_request_raise_flow_error(mocked_httpx_client, flow_url, exception):
+async def test_make_post_request_raise_flow_error(mocked_httpx_client, flow_url, http_exception):
     mocked_httpx_client.return_value.__aenter__.return_value.post = asynctest.CoroutineMock(
-        side_effect=exception
+        side_effect=http_exception
     )
     data = {"name": "lagertha"}
     headers = {"Authorization": "token"}
@@ -138,7 +218,10 @@ async def test_make_post_request_raise_flow_error(mocked_httpx_client, flow_url,
         await make_post_request(flow_url, data=data, timeout=DEFAULT_TIMEOUT, headers=headers)
 
     mocked_httpx_client.return_value.__aenter__.return_value.post.assert_called_with(
-        flow_url, json=data, timeout=DEFAULT_TIMEOUT, headers=headers
+        flow_url,
+        data=encode_json(data),
+        timeout=DEFAULT_TIMEOUT,
+        headers={**headers, "Content-Type": JSON_CONTENT_TYPE},
     )
 
 
@@ -154,10 +237,9 @@ async def test_make_put_request(httpserver, response):
 
 @pytest.mark.asyncio
 @asynctest.patch("bloodaxe.httpx.AsyncClient")
-@pytest.mark.parametrize("exception", [(exception,) for exception in HTTP_EXCEPTIONS])
-async def test_make_put_request_raise_flow_error(mocked_httpx_client, flow_url, exception):
+async def test_make_put_request_raise_flow_error(mocked_httpx_client, flow_url, http_exception):
     mocked_httpx_client.return_value.__aenter__.return_value.put = asynctest.CoroutineMock(
-        side_effect=exception
+        side_effect=http_exception
     )
     data = {"name": "lagertha"}
     headers = {"Authorization": "token"}
@@ -166,7 +248,10 @@ async def test_make_put_request_raise_flow_error(mocked_httpx_client, flow_url,
         await make_put_request(flow_url, data=data, timeout=DEFAULT_TIMEOUT, headers=headers)
 
     mocked_httpx_client.return_value.__aenter__.return_value.put.assert_called_with(
-        flow_url, json=data, timeout=DEFAULT_TIMEOUT, headers=headers
+        flow_url,
+        data=encode_json(data),
+        timeout=DEFAULT_TIMEOUT,
+        headers={**headers, "Content-Type": JSON_CONTENT_TYPE},
     )
 
 
@@ -184,10 +269,9 @@ async def test_make_patch_request(httpserver, response):
 
 @pytest.mark.asyncio
 @asynctest.patch("bloodaxe.httpx.AsyncClient")
-@pytest.mark.parametrize("exception", [(exception,) for exception in HTTP_EXCEPTIONS])
-async def test_make_patch_request_raise_flow_error(mocked_httpx_client, flow_url, exception):
+async def test_make_patch_request_raise_flow_error(mocked_httpx_client, flow_url, http_exception):
     mocked_httpx_client.return_value.__aenter__.return_value.patch = asynctest.CoroutineMock(
-        side_effect=exception
+        side_effect=http_exception
     )
     data = {"name": "lagertha"}
     headers = {"Authorization": "token"}
@@ -196,7 +280,10 @@ async def test_make_patch_request_raise_flow_error(mocked_httpx_client, flow_url
         await make_patch_request(flow_url, data=data, timeout=DEFAULT_TIMEOUT, headers=headers)
 
     mocked_httpx_client.return_value.__aenter__.return_value.patch.assert_called_with(
-        flow_url, json=data, timeout=DEFAULT_TIMEOUT, headers=headers
+        flow_url,
+        data=encode_json(data),
+        timeout=DEFAULT_TIMEOUT,
+        headers={**headers, "Content-Type": JSON_CONTENT_TYPE},
     )
 
 
@@ -211,6 +298,46 @@ async def test_make_request(httpserver, flow_http_method, response, context):
     assert request_response == response
 
 
+@pytest.mark.asyncio
+async def test_make_request_with_invalid_json_response(httpserver, context):
+    httpserver.expect_request("/test/").respond_with_data("<html></html>")
+
+    with pytest.raises(FlowError, match="Invalid json response, request=req_name") as exc_info:
+        await make_request(context, "req_name", httpserver.url_for("/test/"), "GET", timeout=DEFAULT_TIMEOUT)
+
+    assert exc_info.value.kind == ERROR_INVALID_JSON
+
+
+@pytest.mark.asyncio
+async def test_make_request_with_empty_response(httpserver, context):
+    httpserver.expect_request("/test/", method="DELETE").respond_with_data("", status=204)
+
+    request_response = await make_request(
+        context, "req_name", httpserver.url_for("/test/"), "DELETE", timeout=DEFAULT_TIMEOUT
+    )
+
+    assert request_response is None
+
+
+@pytest.mark.asyncio
+async def test_make_request_with_empty_response_and_status_code_check(httpserver, context):
+    httpserver.expect_request("/test/", method="POST").respond_with_data("", status=204)
+
+    with pytest.raises(FlowError) as exc_info:
+        await make_request(
+            context,
+            "req_name",
+            httpserver.url_for("/test/"),
+            "POST",
+            response_check={"status_code": 201},
+            data={"name": "Ivar"},
+            timeout=DEFAULT_TIMEOUT,
+        )
+
+    assert exc_info.value.kind == ERROR_CHECK_STATUS_CODE
+    assert exc_info.value.status_code == 204
+
+
 @pytest.mark.asyncio
 async def test_make_request_with_flow_error(context):
     expected_error_message = "An error ocurred when make_request, invalid http method=TEST"
@@ -249,12 +376,14 @@ async def test_run_flow_with_flow_error(httpserver, toml_data, get_user_response
 
     flow_result = await run_flow(toml_data, verbose=False)
 
-    assert type(flow_result.error) == FlowError
+    assert flow_result.error == ERROR_HTTP_STATUS.format(5)
+    assert flow_result.failed_request == "get_user"
+    assert "500 Server Error" in flow_result.error_message
     assert flow_result.success is False
     assert flow_result.duration > 0
 
 
-def test_show_metrics(mocker, mocked_echo, flows):
+def test_show_metrics(mocker, mocked_echo, flows, metrics):
     mean_time = statistics.mean([flow.duration for flow in flows if flow.success])
     standard_deviation = statistics.stdev([flow.duration for flow in flows if flow.success])
     total_time = sum([flow.duration for flow in flows if flow.success])
@@ -267,18 +396,78 @@ def test_show_metrics(mocker, mocked_echo, flows):
         SECONDS_MASK.format(round(total_time, 2)),
     ]
     expected_tabulate = tabulate([expected_row], headers=TABLE_HEADERS)
-    mocked_echo_calls = (mocker.call("\n"), mocker.call(expected_tabulate))
+    expected_errors_tabulate = tabulate([["get_user", "http_5xx", 1]], headers=ERROR_TABLE_HEADERS)
+    mocked_echo_calls = (
+        mocker.call("\n"),
+        mocker.call(expected_tabulate),
+        mocker.call("\n"),
+        mocker.call(expected_errors_tabulate),
+        mocker.call("\n"),
+        mocker.call(ERROR_SAMPLES_TITLE),
+        mocker.call("get_user (http_5xx): teste error"),
+    )
 
-    show_metrics(flows, total_time)
+    show_metrics(metrics, total_time)
 
     mocked_echo.assert_has_calls(mocked_echo_calls)
 
 
+def test_show_metrics_without_errors(mocker, mocked_echo):
+    metrics = Metrics()
+    metrics.add_flow(Flow(duration=1.0))
+
+    show_metrics(metrics, 1.0)
+
+    assert mocked_echo.call_count == 2
+    mocked_echo.assert_called_with(tabulate([[1, 0, 1, "0.00", "0.00", "1.00"]], headers=TABLE_HEADERS))
+
+
+def test_metrics_add_flow(flows, metrics):
+    durations = [flow.duration for flow in flows if flow.success]
+
+    assert metrics.success_flows == 4
+    assert metrics.error_flows == 1
+    assert metrics.total_flows == 5
+    assert metrics.mean_time == pytest.approx(statistics.mean(durations))
+    assert metrics.standard_deviation == pytest.approx(statistics.stdev(durations))
+    assert metrics.errors == {("get_user", "http_5xx"): 1}
+    assert metrics.error_samples == [("get_user", "http_5xx", "teste error")]
+
+
+def test_metrics_keeps_bounded_error_samples():
+    metrics = Metrics(error_samples_size=3)
+
+    for index in range(1000):
+        metrics.add_flow(
+            Flow(success=False, error=ERROR_TIMEOUT, failed_request="get_user", error_message=str(index))
+        )
+
+    assert metrics.error_flows == 1000
+    assert metrics.errors == {("get_user", ERROR_TIMEOUT): 1000}
+    assert len(metrics.error_samples) == 3
+
+
+@pytest.mark.parametrize(
+    "exception, expected_error",
+    [
+        (httpx.ReadTimeout(), ERROR_TIMEOUT),
+        (httpx.ConnectTimeout(), ERROR_TIMEOUT),
+        (httpx.NetworkError(), ERROR_CONNECT),
+        (httpx.HTTPError(), ERROR_HTTP),
+        (httpx.HTTPError(response=Mock(status_code=404)), "http_4xx"),
+        (httpx.HTTPError(response=Mock(status_code=503)), "http_5xx"),
+    ],
+)
+def test_classify_http_exception(exception, expected_error):
+    assert classify_http_exception(exception) == expected_error
+
+
 @pytest.mark.asyncio
 async def test_start(
     mocker, httpserver, toml_data, mocked_echo, mocked_secho, get_user_response, post_user_response
 ):
     mock_show_metrics = mocker.patch("bloodaxe.show_metrics")
+    mock_show_generator_stats = mocker.patch("bloodaxe.show_generator_stats")
     httpserver.expect_request("/users/1", method="GET").respond_with_json(get_user_response)
     httpserver.expect_request("/users/", method="POST").respond_with_json(post_user_response)
     toml_data["api"][0]["base_url"] = f"http://{httpserver.host}:{httpserver.port}"
@@ -287,7 +476,7 @@ async def test_start(
         "number_of_concurrent_flows"
     ]
 
-    await start(toml_data, verbose=False)
+    metrics = await start(toml_data, verbose=False)
 
     mocked_secho.assert_called_with(
         START_MESSAGE.format(number_of_concurrent_flows, duration),
@@ -296,7 +485,13 @@ async def test_start(
         bold=True,
     )
 
-    mock_show_metrics.assert_called()
+    mock_show_metrics.assert_called_with(metrics, mocker.ANY)
+    mock_show_generator_stats.assert_called_with(generator_stats, mocker.ANY)
+    assert metrics.total_flows > 0
+    assert generator_stats.loop_lag_samples > 0
+    assert generator_stats.overhead[OVERHEAD_TEMPLATING] > 0
+    assert generator_stats.overhead[OVERHEAD_JSON] > 0
+    assert generator_stats.overhead[OVERHEAD_OUTPUT] > 0
 
 
 @pytest.mark.asyncio
@@ -304,6 +499,7 @@ async def test_start_with_verbose(
     mocker, httpserver, toml_data, mocked_echo, mocked_secho, get_user_response, post_user_response
 ):
     mock_show_metrics = mocker.patch("bloodaxe.show_metrics")
+    mock_show_generator_stats = mocker.patch("bloodaxe.show_generator_stats")
     httpserver.expect_request("/users/1", method="GET").respond_with_json(get_user_response)
     httpserver.expect_request("/users/", method="POST").respond_with_json(post_user_response)
     toml_data["api"][0]["base_url"] = f"http://{httpserver.host}:{httpserver.port}"
@@ -311,6 +507,7 @@ async def test_start_with_verbose(
     await start(toml_data, verbose=True)
 
     mock_show_metrics.assert_called()
+    mock_show_generator_stats.assert_called()
     assert mocked_secho.called
 
 
@@ -318,11 +515,14 @@ def test_main(mocker, toml_data):
     mocked_start = mocker.patch("bloodaxe.start")
     mocked_toml_load = mocker.patch("bloodaxe.toml.load")
     mocked_toml_load.return_value = toml_data
+    mocked_set_event_loop_policy = mocker.patch("bloodaxe.set_event_loop_policy", return_value=True)
 
     main("any_path")
 
+    mocked_set_event_loop_policy.assert_called_with(EventLoop.auto)
+
     mocked_toml_load.assert_called_with("any_path")
-    mocked_start.assert_called_with(toml_data, False)
+    mocked_start.assert_called_with(toml_data, False, metrics_port=None, metrics_host=DEFAULT_METRICS_HOST)
 
 
 @pytest.mark.parametrize("exception", [(TypeError,), (toml.TomlDecodeError,)])
@@ -339,7 +539,7 @@ def test_main_with_type_error(exception, mocker, mocked_echo):
 def test_from_file(mocker):
     json_data = {"name": "eric bloodaxe"}
     file_path = "teste.json"
-    mock_json_load = mocker.patch("bloodaxe.json.loads")
+    mock_json_load = mocker.patch("bloodaxe.load_json")
     mock_json_load.return_value = json_data
 
     with patch("builtins.open", mocker.mock_open()) as mock_file:
@@ -353,7 +553,7 @@ def test_from_file(mocker):
 def test_from_file_with_json_decode_error(mocker):
     file_path = "teste.json"
     expected_error_message = f"Invalid json file, file={file_path}"
-    mock_json_load = mocker.patch("bloodaxe.json.loads")
+    mock_json_load = mocker.patch("bloodaxe.load_json")
     mock_json_load.side_effect = json.JSONDecodeError("error", "\n\n", 1)
 
     with patch("builtins.open", mocker.mock_open()) as mock_file:
@@ -429,9 +629,11 @@ def test_check_response_data_with_flow_error():
 
     error_msg = RESPONSE_DATA_CHECK_FAILED_MESSAGE.format(request_name, expected_data, data)
 
-    with pytest.raises(FlowError, match=error_msg):
+    with pytest.raises(FlowError, match=error_msg) as exc_info:
         check_response_data(request_name, data, expected_data, context)
 
+    assert exc_info.value.kind == ERROR_CHECK_DATA
+
 
 def test_check_response_status_code():
     request_name = "test_req"
@@ -450,9 +652,11 @@ def test_check_response_status_code_with_flow_error():
         request_name, expected_status_code, status_code
     )
 
-    with pytest.raises(FlowError, match=error_msg):
+    with pytest.raises(FlowError, match=error_msg) as exc_info:
         check_response_status_code(request_name, status_code, expected_status_code)
 
+    assert exc_info.value.kind == ERROR_CHECK_STATUS_CODE
+
 
 def test_check_response_with_data():
     request_name = "test_req"
@@ -472,3 +676,1308 @@ def test_check_response_with_status_code():
     response_check = {"status_code": status_code}
 
     check_response(request_name, data, status_code, context, response_check)
+
+
+@pytest.mark.parametrize(
+    "think_time, expected_think_time",
+    [
+        (2, 2),
+        (0.5, 0.5),
+        ({"value": 3}, 3),
+        ({"distribution": "fixed", "value": 1.5}, 1.5),
+        ({"distribution": "fixed", "value": -1}, 0),
+    ],
+)
+def test_get_think_time_with_fixed_value(think_time, expected_think_time):
+    assert get_think_time(think_time) == expected_think_time
+
+
+def test_get_think_time_with_uniform_distribution():
+    think_time = {"distribution": "uniform", "min": 1, "max": 2}
+
+    assert all(1 <= get_think_time(think_time) <= 2 for _ in range(100))
+
+
+def test_get_think_time_with_exponential_distribution(mocker):
+    mocked_expovariate = mocker.patch("bloodaxe.random.expovariate", return_value=0.7)
+    think_time = {"distribution": "exponential", "mean": 2}
+
+    assert get_think_time(think_time) == 0.7
+    mocked_expovariate.assert_called_with(0.5)
+
+
+def test_get_think_time_with_invalid_distribution():
+    expected_error_message = "Invalid think_time distribution, distribution=normal"
+
+    with pytest.raises(ValueError, match=expected_error_message):
+        get_think_time({"distribution": "normal", "mean": 1})
+
+
+@pytest.mark.parametrize(
+    "think_time, expected_error_message",
+    [
+        ("2", "Invalid think_time, think_time=2"),
+        ({"distribution": "normal", "mean": 1}, "Invalid think_time distribution, distribution=normal"),
+        ({"distribution": "uniform", "min": 1}, "Invalid think_time max, distribution=uniform"),
+        ({"value": "2"}, "Invalid think_time value, distribution=fixed"),
+        ({"distribution": "exponential", "mean": 0}, "Invalid think_time mean, mean=0"),
+    ],
+)
+def test_validate_think_time_with_invalid_config(think_time, expected_error_message):
+    with pytest.raises(ValueError, match=expected_error_message):
+        validate_think_time(think_time)
+
+
+@pytest.mark.parametrize(
+    "request_config, expected_error_message",
+    [
+        ({"name": "get_user", "think_time": {"distribution": "normal"}}, "Invalid think_time distribution"),
+        ({"name": "get_user", "compress": "br"}, "Invalid compress encoding, compress=br"),
+        ({"name": "get_user", "cache_result": {"scope": "forever"}}, "Invalid cache_result scope"),
+        ({"name": "get_user", "cache_result": {"ttl": "1h"}}, "Invalid cache_result ttl, ttl=1h"),
+    ],
+)
+def test_validate_flow_config_with_invalid_request(toml_data, request_config, expected_error_message):
+    toml_data["request"].append(request_config)
+
+    with pytest.raises(ValueError, match=expected_error_message):
+        validate_flow_config(toml_data)
+
+
+@pytest.mark.parametrize(
+    "configs, expected_error_message",
+    [
+        ({"number_of_concurrent_flows": 1}, "Missing config, duration is required"),
+        ({"duration": 1}, "Missing config, number_of_concurrent_flows is required"),
+        ({"number_of_concurrent_flows": 0, "duration": 1}, "Invalid number_of_concurrent_flows"),
+        ({"number_of_concurrent_flows": 1.5, "duration": 1}, "Invalid number_of_concurrent_flows"),
+        ({"number_of_concurrent_flows": 1, "virtual_users": 0, "duration": 1}, "Invalid virtual_users"),
+        ({"number_of_concurrent_flows": 1, "virtual_users": True, "duration": 1}, "Invalid virtual_users"),
+        ({"number_of_concurrent_flows": 1, "duration": -1}, "Invalid duration, duration=-1"),
+        ({"number_of_concurrent_flows": 1, "duration": 1, "pacing": "1s"}, "Invalid pacing, pacing=1s"),
+        ({"number_of_concurrent_flows": 1, "duration": 1, "warmup": -0.5}, "Invalid warmup, warmup=-0.5"),
+        (
+            {"number_of_concurrent_flows": 1, "duration": 1, "shutdown_timeout": -1},
+            "Invalid shutdown_timeout",
+        ),
+    ],
+)
+def test_validate_flow_config_with_invalid_configs(toml_data, configs, expected_error_message):
+    toml_data["configs"] = configs
+
+    with pytest.raises(ValueError, match=expected_error_message):
+        validate_flow_config(toml_data)
+
+
+def test_validate_flow_config(toml_data):
+    toml_data["request"][0]["think_time"] = {"distribution": "uniform", "min": 1, "max": 3}
+    toml_data["request"][0]["compress"] = "deflate"
+    toml_data["request"][0]["cache_result"] = {"scope": "worker", "ttl": 60}
+    toml_data["configs"].update(virtual_users=2, pacing=0.5, warmup=0, shutdown_timeout=5)
+
+    validate_flow_config(toml_data)
+
+
+@pytest.mark.asyncio
+async def test_start_with_invalid_config(mocker, toml_data):
+    mocked_run_worker = mocker.patch("bloodaxe.run_worker")
+    toml_data["request"][0]["compress"] = "br"
+
+    with pytest.raises(ValueError, match="Invalid compress encoding"):
+        await start(toml_data, verbose=False)
+
+    mocked_run_worker.assert_not_called()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("name", ["number_of_concurrent_flows", "virtual_users"])
+async def test_start_without_flows(mocker, toml_data, name):
+    mocked_run_worker = mocker.patch("bloodaxe.run_worker")
+    toml_data["configs"][name] = 0
+
+    with pytest.raises(ValueError, match=f"Invalid {name}, {name}=0"):
+        await start(toml_data, verbose=False)
+
+    mocked_run_worker.assert_not_called()
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("mocked_echo")
+async def test_run_flow_with_think_time_and_pacing(mocker, httpserver, toml_data, get_user_response):
+    mocked_sleep = mocker.patch("bloodaxe.asyncio.sleep", new=asynctest.CoroutineMock())
+    toml_data["api"][0]["base_url"] = f"http://{httpserver.host}:{httpserver.port}"
+    toml_data["configs"]["pacing"] = 60
+    toml_data["request"] = toml_data["request"][:1]
+    toml_data["request"][0]["think_time"] = 30
+    httpserver.expect_request("/users/1", method="GET").respond_with_json(get_user_response)
+
+    flow_result = await run_flow(toml_data, verbose=False)
+
+    assert flow_result.success is True
+    assert 0 < flow_result.duration < 1
+    assert mocked_sleep.await_count == 2
+    assert mocked_sleep.await_args_list[0] == mocker.call(30)
+    assert 59 < mocked_sleep.await_args_list[1][0][0] < 60
+    assert "think_time" in toml_data["request"][0]
+
+
+@pytest.mark.parametrize(
+    "cache_result, expected_cache_config",
+    [
+        (None, None),
+        (False, None),
+        (True, {"scope": "run", "ttl": None}),
+        ({"ttl": 3600}, {"scope": "run", "ttl": 3600}),
+        ({"scope": "worker"}, {"scope": "worker", "ttl": None}),
+        ({"scope": "virtual_user", "ttl": 60}, {"scope": "virtual_user", "ttl": 60}),
+    ],
+)
+def test_get_cache_config(cache_result, expected_cache_config):
+    assert get_cache_config({"name": "get_token", "cache_result": cache_result}) == expected_cache_config
+
+
+def test_get_cache_config_with_invalid_scope():
+    expected_error_message = "Invalid cache_result scope, scope=forever"
+
+    with pytest.raises(ValueError, match=expected_error_message):
+        get_cache_config({"name": "get_token", "cache_result": {"scope": "forever"}})
+
+
+def test_cached_result_expired(mocker):
+    mocker.patch("bloodaxe.time.time", return_value=100)
+
+    assert CachedResult(value="token").expired() is False
+    assert CachedResult(value="token", expires_at=101).expired() is False
+    assert CachedResult(value="token", expires_at=100).expired() is True
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("mocked_echo")
+async def test_run_flow_with_cached_result(httpserver, toml_data, cached_token_requests, get_user_response):
+    toml_data["api"][0]["base_url"] = f"http://{httpserver.host}:{httpserver.port}"
+    toml_data["request"] = cached_token_requests
+    httpserver.expect_request("/token/", method="POST").respond_with_json({"access_token": "token_1"})
+    httpserver.expect_request(
+        "/users/1", method="GET", headers={"X-Auth-Token": "token_1"}
+    ).respond_with_json(get_user_response)
+    caches = make_caches()
+
+    first_flow_result = await run_flow(toml_data, verbose=False, caches=caches)
+    second_flow_result = await run_flow(toml_data, verbose=False, caches=caches)
+
+    assert first_flow_result.success is True
+    assert second_flow_result.success is True
+    assert [request.path for request, _ in httpserver.log] == ["/token/", "/users/1", "/users/1"]
+    assert caches["run"]["get_token"].value == {"access_token": "token_1"}
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("mocked_echo")
+async def test_run_flow_with_expired_cached_result(
+    httpserver, toml_data, cached_token_requests, get_user_response
+):
+    toml_data["api"][0]["base_url"] = f"http://{httpserver.host}:{httpserver.port}"
+    toml_data["request"] = cached_token_requests
+    httpserver.expect_request("/token/", method="POST").respond_with_json({"access_token": "token_2"})
+    httpserver.expect_request("/users/1", method="GET").respond_with_json(get_user_response)
+    caches = make_caches()
+    caches["run"]["get_token"] = CachedResult(value={"access_token": "token_1"}, expires_at=0)
+
+    flow_result = await run_flow(toml_data, verbose=False, caches=caches)
+
+    assert flow_result.success is True
+    assert [request.path for request, _ in httpserver.log] == ["/token/", "/users/1"]
+    assert caches["run"]["get_token"].value == {"access_token": "token_2"}
+    assert caches["run"]["get_token"].expires_at is not None
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("mocked_echo")
+async def test_run_flow_refresh_cached_result_on_unauthorized(
+    httpserver, toml_data, cached_token_requests, get_user_response
+):
+    toml_data["api"][0]["base_url"] = f"http://{httpserver.host}:{httpserver.port}"
+    toml_data["request"] = cached_token_requests
+    httpserver.expect_request("/token/", method="POST").respond_with_json({"access_token": "token_2"})
+    httpserver.expect_request(
+        "/users/1", method="GET", headers={"X-Auth-Token": "token_1"}
+    ).respond_with_json({}, status=401)
+    httpserver.expect_request(
+        "/users/1", method="GET", headers={"X-Auth-Token": "token_2"}
+    ).respond_with_json(get_user_response)
+    caches = make_caches()
+    caches["run"]["get_token"] = CachedResult(value={"access_token": "token_1"})
+
+    flow_result = await run_flow(toml_data, verbose=False, caches=caches)
+
+    assert flow_result.success is True
+    assert [request.path for request, _ in httpserver.log] == ["/users/1", "/token/", "/users/1"]
+    assert caches["run"]["get_token"].value == {"access_token": "token_2"}
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("mocked_echo")
+async def test_concurrent_flows_fetch_cached_result_once(
+    httpserver, toml_data, cached_token_requests, get_user_response
+):
+    toml_data["api"][0]["base_url"] = f"http://{httpserver.host}:{httpserver.port}"
+    toml_data["request"] = cached_token_requests
+    httpserver.expect_request("/token/", method="POST").respond_with_json({"access_token": "token_1"})
+    httpserver.expect_request("/users/1", method="GET").respond_with_json(get_user_response)
+    caches = make_caches()
+
+    flow_results = await asyncio.gather(
+        *[run_flow(toml_data, verbose=False, caches=caches) for _ in range(5)]
+    )
+
+    assert all(flow_result.success for flow_result in flow_results)
+    assert [request.path for request, _ in httpserver.log].count("/token/") == 1
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("mocked_echo")
+async def test_concurrent_flows_refresh_cached_result_once(
+    httpserver, toml_data, cached_token_requests, get_user_response
+):
+    toml_data["api"][0]["base_url"] = f"http://{httpserver.host}:{httpserver.port}"
+    toml_data["request"] = cached_token_requests
+    httpserver.expect_request("/token/", method="POST").respond_with_json({"access_token": "token_2"})
+    httpserver.expect_request(
+        "/users/1", method="GET", headers={"X-Auth-Token": "token_1"}
+    ).respond_with_json({}, status=401)
+    httpserver.expect_request(
+        "/users/1", method="GET", headers={"X-Auth-Token": "token_2"}
+    ).respond_with_json(get_user_response)
+    caches = make_caches()
+    caches["run"]["get_token"] = CachedResult(value={"access_token": "token_1"})
+
+    flow_results = await asyncio.gather(
+        *[run_flow(toml_data, verbose=False, caches=caches) for _ in range(5)]
+    )
+
+    assert all(flow_result.success for flow_result in flow_results)
+    assert [request.path for request, _ in httpserver.log].count("/token/") == 1
+    assert caches["run"]["get_token"].value == {"access_token": "token_2"}
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("mocked_echo")
+async def test_run_flow_with_failed_cached_result_fetch(httpserver, toml_data, cached_token_requests):
+    toml_data["api"][0]["base_url"] = f"http://{httpserver.host}:{httpserver.port}"
+    toml_data["request"] = cached_token_requests
+    httpserver.expect_request("/token/", method="POST").respond_with_json({}, status=500)
+    caches = make_caches()
+
+    flow_result = await run_flow(toml_data, verbose=False, caches=caches)
+
+    assert flow_result.success is False
+    assert flow_result.failed_request == "get_token"
+    assert caches["run"] == {}
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("mocked_echo")
+async def test_run_flow_with_unauthorized_without_cached_result(httpserver, toml_data, cached_token_requests):
+    toml_data["api"][0]["base_url"] = f"http://{httpserver.host}:{httpserver.port}"
+    toml_data["request"] = cached_token_requests
+    httpserver.expect_request("/token/", method="POST").respond_with_json({"access_token": "token_1"})
+    httpserver.expect_request("/users/1", method="GET").respond_with_json({}, status=401)
+
+    flow_result = await run_flow(toml_data, verbose=False)
+
+    assert flow_result.success is False
+    assert flow_result.error == ERROR_HTTP_STATUS.format(4)
+    assert [request.path for request, _ in httpserver.log] == ["/token/", "/users/1"]
+
+
+@pytest.mark.asyncio
+async def test_virtual_user_cookies(httpserver):
+    httpserver.expect_request("/login/").respond_with_response(
+        Response("{}", headers={"Set-Cookie": "session=ragnar; Path=/"})
+    )
+    virtual_user = VirtualUser()
+
+    async with httpx.AsyncClient() as client:
+        virtual_user.restore_cookies(client)
+        await client.get(httpserver.url_for("/login/"))
+        virtual_user.keep_cookies(client)
+
+        client.cookies = {"session": "other"}
+        virtual_user.restore_cookies(client)
+
+        assert client.cookies["session"] == "ragnar"
+
+    assert len(virtual_user.cookies) == 1
+
+
+def test_virtual_user_without_cookies():
+    virtual_user = VirtualUser()
+    client = httpx.AsyncClient()
+    client.cookies = {"session": "other"}
+
+    virtual_user.restore_cookies(client)
+    virtual_user.keep_cookies(client)
+
+    assert len(client.cookies) == 0
+    assert virtual_user.cookies is None
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("mocked_echo")
+async def test_run_flow_with_virtual_user(httpserver, toml_data, get_user_response):
+    toml_data["api"][0]["base_url"] = f"http://{httpserver.host}:{httpserver.port}"
+    toml_data["request"] = toml_data["request"][:1]
+    httpserver.expect_request("/users/1", method="GET").respond_with_json(get_user_response)
+    virtual_user = VirtualUser()
+    virtual_user.context["previous_request"] = {"id": 1}
+
+    flow_result = await run_flow(toml_data, verbose=False, virtual_user=virtual_user)
+
+    assert flow_result.success is True
+    assert virtual_user.context == {"previous_request": {"id": 1}, "get_user": get_user_response}
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("mocked_echo")
+async def test_run_worker_keeps_virtual_users_sessions(httpserver, toml_data):
+    sessions = itertools.count()
+
+    def login_handler(request):
+        if request.cookies.get("session"):
+            return Response(json.dumps({"session": request.cookies["session"]}))
+        return Response("{}", headers={"Set-Cookie": f"session={next(sessions)}; Path=/"})
+
+    toml_data["api"][0]["base_url"] = f"http://{httpserver.host}:{httpserver.port}"
+    toml_data["request"] = [
+        {"name": "login", "url": "{{ user_api.base_url }}/login/", "method": "GET", "save_result": True}
+    ]
+    httpserver.expect_request("/login/").respond_with_handler(login_handler)
+    virtual_users = [VirtualUser(), VirtualUser()]
+
+    metrics = Metrics()
+
+    await run_worker(toml_data, False, virtual_users, {}, time.time() + 0.5, metrics)
+
+    assert metrics.success_flows > 2
+    assert metrics.error_flows == 0
+    assert [virtual_user.context["login"] for virtual_user in virtual_users] == [
+        {"session": "0"},
+        {"session": "1"},
+    ]
+
+
+@pytest.mark.asyncio
+async def test_stub_server():
+    async with StubServer(payload_size=3) as stub_server:
+        async with httpx.AsyncClient() as client:
+            get_response = await make_get_request(
+                f"{stub_server.url}/users/1", DEFAULT_TIMEOUT, client=client
+            )
+            post_response = await make_post_request(
+                f"{stub_server.url}/users/", {"name": "Ubbe"}, DEFAULT_TIMEOUT, client=client
+            )
+
+    assert get_response.json() == {"payload": "xxx"}
+    assert post_response.json() == {"payload": "xxx"}
+    assert stub_server.number_of_requests == 2
+
+
+@pytest.mark.asyncio
+async def test_stub_server_with_latency():
+    async with StubServer(latency=0.2) as stub_server:
+        start_time = time.time()
+        await make_get_request(stub_server.url, DEFAULT_TIMEOUT)
+
+    assert time.time() - start_time >= 0.2
+
+
+@pytest.mark.asyncio
+async def test_stub_server_with_error_rate():
+    async with StubServer(error_rate=1) as stub_server:
+        with pytest.raises(FlowError) as exc_info:
+            await make_get_request(stub_server.url, DEFAULT_TIMEOUT)
+
+    assert exc_info.value.status_code == 500
+    assert exc_info.value.kind == ERROR_HTTP_STATUS.format(5)
+
+
+def test_track_overhead_excludes_nested_overhead(mocker):
+    mocker.patch("bloodaxe.time.perf_counter", side_effect=[0, 1, 3, 6])
+    generator_stats.reset()
+
+    @track_overhead(OVERHEAD_JSON)
+    def inner():
+        pass
+
+    @track_overhead(OVERHEAD_CHECKS)
+    def outer():
+        inner()
+
+    outer()
+
+    assert generator_stats.overhead[OVERHEAD_JSON] == 2
+    assert generator_stats.overhead[OVERHEAD_CHECKS] == 4
+    assert generator_stats.nested_time == 6
+
+
+def test_generator_stats_loop_lag():
+    stats = GeneratorStats()
+
+    assert stats.loop_lag_mean == 0
+
+    stats.add_loop_lag(0.01)
+    stats.add_loop_lag(0.03)
+
+    assert stats.loop_lag_mean == pytest.approx(0.02)
+    assert stats.loop_lag_max == 0.03
+
+
+@pytest.mark.asyncio
+async def test_probe_event_loop_lag():
+    stats = GeneratorStats()
+    probe = asyncio.ensure_future(probe_event_loop_lag(stats, interval=0.01))
+
+    await asyncio.sleep(0.02)
+    time.sleep(0.1)
+    await asyncio.sleep(0.02)
+    probe.cancel()
+
+    assert stats.loop_lag_samples > 0
+    assert stats.loop_lag_max >= 0.05
+
+
+def test_show_generator_stats(mocker, mocked_echo, mocked_secho):
+    stats = GeneratorStats(loop_lag_samples=2, loop_lag_total=0.004, loop_lag_max=0.003, cpu_time=1)
+    stats.overhead[OVERHEAD_TEMPLATING] = 0.5
+    expected_row = ["2.00ms", "3.00ms", "0.50", "0.00", "0.00", "0.00", "0.00", "10.0%"]
+
+    show_generator_stats(stats, 10)
+
+    mocked_echo.assert_called_with(tabulate([expected_row], headers=GENERATOR_TABLE_HEADERS))
+    mocked_secho.assert_not_called()
+
+
+@pytest.mark.parametrize("loop_lag_total, cpu_time", [(0.2, 1), (0, 9.5)])
+def test_show_generator_stats_with_overhead_warning(mocked_echo, mocked_secho, loop_lag_total, cpu_time):
+    stats = GeneratorStats(loop_lag_samples=10, loop_lag_total=loop_lag_total, cpu_time=cpu_time)
+    expected_warning = GENERATOR_OVERHEAD_WARNING.format(
+        f"{loop_lag_total / 10 * 1000:.2f}ms", f"{cpu_time / 10 * 100:.1f}%"
+    )
+
+    show_generator_stats(stats, 10)
+
+    mocked_secho.assert_called_with(expected_warning, fg=typer.colors.YELLOW, bold=True)
+
+
+def test_lazy_module():
+    lazy_json = LazyModule("json")
+
+    assert lazy_json._module is None
+    assert lazy_json.dumps({"name": "Rollo"}) == json.dumps({"name": "Rollo"})
+    assert lazy_json._module is json
+
+
+def test_preload_modules(mocker):
+    lazy_modules = (LazyModule("httpx"), LazyModule("jinja2"))
+    mocker.patch("bloodaxe.RUN_MODULES", lazy_modules)
+    mocker.patch("bloodaxe.json_codec", None)
+
+    preload_modules()
+
+    assert [lazy_module._module for lazy_module in lazy_modules] == [httpx, jinja2]
+    assert bloodaxe.json_codec is not None
+
+
+@pytest.mark.asyncio
+async def test_start_preloads_modules_before_probe(mocker, toml_data, mocked_echo, mocked_secho):
+    mocker.patch("bloodaxe.show_metrics")
+    mocker.patch("bloodaxe.show_generator_stats")
+    mocker.patch("bloodaxe.run_worker", new=asynctest.CoroutineMock())
+    manager = Mock()
+    manager.attach_mock(mocker.patch("bloodaxe.preload_modules"), "preload_modules")
+    manager.attach_mock(
+        mocker.patch("bloodaxe.probe_event_loop_lag", new=asynctest.CoroutineMock()), "probe_event_loop_lag"
+    )
+
+    await start(toml_data, verbose=False)
+
+    assert [call[0] for call in manager.mock_calls][:2] == ["preload_modules", "probe_event_loop_lag"]
+
+
+def test_import_does_not_load_heavy_modules():
+    heavy_modules = ["httpx", "jinja2", "tabulate", "toml"]
+    code = f"import sys, bloodaxe; print([module for module in {heavy_modules} if module in sys.modules])"
+
+    output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+
+    assert output.stdout.strip() == "[]"
+
+
+def test_set_event_loop_policy_with_asyncio(mocker):
+    mocked_set_policy = mocker.patch("bloodaxe.asyncio.set_event_loop_policy")
+
+    assert set_event_loop_policy(EventLoop.asyncio) is True
+    mocked_set_policy.assert_not_called()
+
+
+@pytest.mark.parametrize("loop", [EventLoop.auto, EventLoop.uvloop])
+def test_set_event_loop_policy_with_uvloop(mocker, loop):
+    mocked_set_policy = mocker.patch("bloodaxe.asyncio.set_event_loop_policy")
+    mocked_import = mocker.patch("bloodaxe.importlib.import_module")
+
+    assert set_event_loop_policy(loop) is True
+    mocked_import.assert_called_with("uvloop")
+    mocked_set_policy.assert_called_with(mocked_import.return_value.EventLoopPolicy.return_value)
+
+
+@pytest.mark.parametrize("loop, expected_result", [(EventLoop.auto, True), (EventLoop.uvloop, False)])
+def test_set_event_loop_policy_without_uvloop(mocker, loop, expected_result):
+    mocked_set_policy = mocker.patch("bloodaxe.asyncio.set_event_loop_policy")
+    mocker.patch("bloodaxe.importlib.import_module", side_effect=ImportError)
+
+    assert set_event_loop_policy(loop) is expected_result
+    mocked_set_policy.assert_not_called()
+
+
+def test_main_without_uvloop(mocker, mocked_echo, toml_data):
+    mocked_start = mocker.patch("bloodaxe.start")
+    mocker.patch("bloodaxe.toml.load", return_value=toml_data)
+    mocker.patch("bloodaxe.set_event_loop_policy", return_value=False)
+
+    with pytest.raises(typer.Exit) as exc_info:
+        main("any_path", loop=EventLoop.uvloop)
+
+    assert exc_info.value.exit_code == 1
+    mocked_echo.assert_called_with(UVLOOP_NOT_INSTALLED_MESSAGE)
+    mocked_start.assert_not_called()
+
+
+def test_cli_replay_without_uvloop(mocker, toml_data, access_log):
+    mocked_replay = mocker.patch("bloodaxe.replay")
+    mocker.patch("bloodaxe.toml.load", return_value=toml_data)
+    mocker.patch("bloodaxe.set_event_loop_policy", return_value=False)
+
+    result = CliRunner().invoke(app, ["replay", "example.toml", str(access_log), "--loop", "uvloop"])
+
+    assert result.exit_code == 1
+    assert UVLOOP_NOT_INSTALLED_MESSAGE in result.output
+    mocked_replay.assert_not_called()
+
+
+def test_request_stats_add():
+    request_stats = RequestStats()
+
+    request_stats.add(0.001)
+    request_stats.add(LATENCY_BUCKETS[0])
+    request_stats.add(0.3)
+    request_stats.add(60)
+
+    assert request_stats.count == 4
+    assert request_stats.total_time == pytest.approx(60.306)
+    assert request_stats.buckets[0] == 2
+    assert request_stats.buckets[LATENCY_BUCKETS.index(0.5)] == 1
+    assert request_stats.buckets[-1] == 1
+
+
+@pytest.mark.asyncio
+async def test_make_request_with_metrics(httpserver, response, context):
+    httpserver.expect_request("/test/").respond_with_json(response)
+    httpserver.expect_request("/error/").respond_with_json(response, status=503)
+    metrics = Metrics()
+
+    await make_request(context, "req_name", httpserver.url_for("/test/"), "GET", metrics=metrics, timeout=1)
+    with pytest.raises(FlowError):
+        await make_request(
+            context, "req_error", httpserver.url_for("/error/"), "GET", metrics=metrics, timeout=1
+        )
+
+    assert set(metrics.requests) == {("req_name", 200), ("req_error", 503)}
+    assert metrics.requests[("req_name", 200)].count == 1
+
+
+def test_render_prometheus_metrics(metrics):
+    metrics.add_request("get_user", 200, 0.02)
+    metrics.add_request('get "user"', ERROR_TIMEOUT, 12)
+
+    text = render_prometheus_metrics(metrics)
+
+    assert 'bloodaxe_flows_total{result="success"} 4' in text
+    assert 'bloodaxe_flows_total{result="error"} 1' in text
+    assert 'bloodaxe_flow_errors_total{request="get_user",error="http_5xx"} 1' in text
+    assert 'bloodaxe_request_duration_seconds_bucket{request="get_user",status="200",le="0.01"} 0' in text
+    assert 'bloodaxe_request_duration_seconds_bucket{request="get_user",status="200",le="0.025"} 1' in text
+    assert 'bloodaxe_request_duration_seconds_bucket{request="get_user",status="200",le="10"} 1' in text
+    assert 'bloodaxe_request_duration_seconds_count{request="get_user",status="200"} 1' in text
+    assert (
+        'bloodaxe_request_duration_seconds_bucket{request="get \\"user\\"",status="timeout",le="10"} 0'
+        in text
+    )
+    assert (
+        'bloodaxe_request_duration_seconds_bucket{request="get \\"user\\"",status="timeout",le="+Inf"} 1'
+        in text
+    )
+    assert text.endswith("\n")
+
+
+@pytest.mark.asyncio
+async def test_start_metrics_server(metrics):
+    metrics_server = await start_metrics_server(metrics, 0, host="127.0.0.1")
+    port = metrics_server.sockets[0].getsockname()[1]
+
+    async with httpx.AsyncClient() as client:
+        resp = await client.get(f"http://127.0.0.1:{port}/metrics")
+        metrics.add_flow(Flow(duration=1.0))
+        second_resp = await client.get(f"http://127.0.0.1:{port}/metrics")
+
+    metrics_server.close()
+    await metrics_server.wait_closed()
+
+    assert resp.status_code == 200
+    assert resp.headers["Content-Type"].startswith("text/plain; version=0.0.4")
+    assert resp.text == render_prometheus_metrics(
+        Metrics(success_flows=4, error_flows=1, errors=metrics.errors)
+    )
+    assert 'bloodaxe_flows_total{result="success"} 5' in second_resp.text
+
+
+@pytest.mark.asyncio
+async def test_start_with_metrics_port(mocker, toml_data, mocked_echo, mocked_secho):
+    mocker.patch("bloodaxe.show_metrics")
+    mocker.patch("bloodaxe.show_generator_stats")
+    mocked_metrics_server = mocker.patch("bloodaxe.start_metrics_server", new=asynctest.CoroutineMock())
+    mocked_metrics_server.return_value.wait_closed = asynctest.CoroutineMock()
+    toml_data["request"] = []
+
+    metrics = await start(toml_data, verbose=False, metrics_port=9100)
+
+    mocked_metrics_server.assert_awaited_with(metrics, 9100, DEFAULT_METRICS_HOST)
+    mocked_metrics_server.return_value.close.assert_called()
+    mocked_echo.assert_any_call(METRICS_SERVER_MESSAGE.format(DEFAULT_METRICS_HOST, 9100))
+
+
+@pytest.mark.asyncio
+async def test_start_with_metrics_port_in_use(mocker, toml_data, mocked_echo, mocked_secho):
+    mocked_run_worker = mocker.patch("bloodaxe.run_worker")
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        sock.listen()
+        port = sock.getsockname()[1]
+
+        with pytest.raises(typer.Exit) as exc_info:
+            await start(toml_data, verbose=False, metrics_port=port)
+
+    assert exc_info.value.exit_code == 1
+    assert mocked_secho.call_args[0][0].startswith(METRICS_SERVER_ERROR_MESSAGE.format("127.0.0.1", port, ""))
+    mocked_run_worker.assert_not_called()
+
+
+def test_cli_with_metrics_host(mocker, toml_data):
+    mocked_start = mocker.patch("bloodaxe.start")
+    mocker.patch("bloodaxe.toml.load", return_value=toml_data)
+    mocker.patch("bloodaxe.set_event_loop_policy", return_value=True)
+
+    result = CliRunner().invoke(app, ["example.toml", "--metrics-port", "9100", "--metrics-host", "0.0.0.0"])
+
+    assert result.exit_code == 0
+    mocked_start.assert_called_with(toml_data, False, metrics_port=9100, metrics_host="0.0.0.0")
+
+
+@pytest.mark.asyncio
+async def test_start_with_worker_error(mocker, toml_data, mocked_echo, mocked_secho, unused_port):
+    mock_show_metrics = mocker.patch("bloodaxe.show_metrics")
+    mock_show_generator_stats = mocker.patch("bloodaxe.show_generator_stats")
+    mocker.patch("bloodaxe.run_worker", new=asynctest.CoroutineMock(side_effect=ValueError("invalid")))
+
+    with pytest.raises(ValueError, match="invalid"):
+        await start(toml_data, verbose=False, metrics_port=unused_port)
+
+    mock_show_metrics.assert_called()
+    mock_show_generator_stats.assert_called()
+    assert asyncio.all_tasks() == {asyncio.current_task()}
+    with socket.socket() as sock:
+        sock.bind(("0.0.0.0", unused_port))
+
+
+@pytest.mark.parametrize(
+    "line, log_format",
+    [
+        (
+            '127.0.0.1 - frank [10/Oct/2000:13:55:36 -0700] "GET /users/1?name=Bjorn HTTP/1.0" 200 2326',
+            "auto",
+        ),
+        (
+            '127.0.0.1 - - [10/Oct/2000:13:55:36 -0700] "GET /users/1?name=Bjorn HTTP/1.1" 200 2326 '
+            '"http://www.example.com/start.html" "Mozilla/4.08"',
+            LogFormat.combined,
+        ),
+        ('{"timestamp": 971211336, "method": "get", "path": "/users/1?name=Bjorn"}', "auto"),
+        ('{"time": "2000-10-10T20:55:36Z", "url": "http://api/users/1?name=Bjorn"}', LogFormat.jsonl),
+    ],
+)
+def test_parse_log_line(line, log_format):
+    assert parse_log_line(line, log_format) == LogRecord(
+        timestamp=971211336.0, method="GET", path="/users/1?name=Bjorn"
+    )
+
+
+@pytest.mark.parametrize(
+    "line",
+    [
+        "",
+        "not an access log line",
+        '127.0.0.1 - - [99/Foo/2000:13:55:36 -0700] "GET / HTTP/1.1" 200 1',
+        '{"timestamp": 1}',
+        '{"path": "/users/1"}',
+        "{invalid json",
+    ],
+)
+def test_parse_log_line_with_invalid_line(line):
+    assert parse_log_line(line) is None
+
+
+def test_map_log_path():
+    api_info = [
+        {"name": "default_api", "base_url": "http://default/"},
+        {"name": "user_api", "base_url": "http://users", "path_prefix": "/users"},
+    ]
+
+    assert map_log_path(api_info, "/users/1") == ("user_api", "http://users/users/1")
+    assert map_log_path(api_info, "/orders/1") == ("default_api", "http://default/orders/1")
+    assert map_log_path(api_info[1:], "/orders/1") == (None, None)
+
+
+@pytest.mark.asyncio
+async def test_replay(httpserver, tmp_path, mocked_echo, mocked_secho):
+    httpserver.expect_request("/users/1", method="GET").respond_with_data("<html></html>")
+    httpserver.expect_request("/users/2").respond_with_json({}, status=404)
+    httpserver.expect_request("/users/", method="POST").respond_with_data("", status=201)
+    log_file = tmp_path / "access.log"
+    log_file.write_text(
+        "\n".join(
+            [
+                '{"timestamp": 100.0, "method": "GET", "path": "/users/1"}',
+                '127.0.0.1 - - [01/Jan/1970:00:01:40 +0000] "GET /users/2 HTTP/1.1" 200 1',
+                "invalid line",
+                '{"timestamp": 100.2, "method": "POST", "path": "/users/"}',
+                '{"timestamp": 100.4, "method": "DELETE", "path": "/users/1"}',
+            ]
+        )
+    )
+    toml_data = {"api": [{"name": "user_api", "base_url": httpserver.url_for("/")}]}
+
+    start_time = time.time()
+    metrics = await replay(toml_data, log_file, LogFormat.auto, 2, 10, DEFAULT_TIMEOUT, verbose=True)
+
+    assert 0.2 <= time.time() - start_time < 1
+    assert metrics.success_flows == 2
+    assert metrics.error_flows == 2
+    assert metrics.errors == {("GET user_api", "http_4xx"): 1, ("DELETE user_api", "http_5xx"): 1}
+    assert set(metrics.requests) == {
+        ("GET user_api", 200),
+        ("GET user_api", 404),
+        ("POST user_api", 201),
+        ("DELETE user_api", 500),
+    }
+    assert metrics.transfers["GET user_api"].received_decoded_bytes == len("<html></html>")
+    assert set(metrics.transfers) == {"GET user_api", "POST user_api", "DELETE user_api"}
+    mocked_echo.assert_any_call(REPLAY_SKIPPED_MESSAGE.format(1, 0))
+
+
+def test_read_log_lines_with_invalid_utf8(tmp_path):
+    log_file = tmp_path / "access.log"
+    log_file.write_bytes(b'127.0.0.1 - - [10/Oct/2000:13:55:36 -0700] "GET /users/\xff HTTP/1.1" 200 2326\n')
+
+    lines = list(read_log_lines(log_file))
+
+    assert len(lines) == 1
+    assert parse_log_line(lines[0]).path == "/users/\ufffd"
+
+
+@pytest.mark.parametrize(
+    "option",
+    [["--speed", "0"], ["--speed", "-1"], ["--max-in-flight", "0"]],
+)
+def test_cli_replay_with_invalid_option(mocker, access_log, option):
+    mocked_replay = mocker.patch("bloodaxe.replay")
+
+    result = CliRunner().invoke(app, ["replay", "example.toml", str(access_log), *option])
+
+    assert result.exit_code == 2
+    mocked_replay.assert_not_called()
+
+
+@pytest.mark.parametrize("log_file", ["missing.log", "."])
+def test_cli_replay_with_invalid_log_file(mocker, toml_data, log_file):
+    mocked_replay = mocker.patch("bloodaxe.replay")
+    mocker.patch("bloodaxe.toml.load", return_value=toml_data)
+
+    result = CliRunner().invoke(app, ["replay", "example.toml", log_file])
+
+    assert result.exit_code == 2
+    assert "Invalid value for 'LOG_FILE'" in result.output
+    mocked_replay.assert_not_called()
+
+
+def test_cli_runs_flow_by_default(mocker, toml_data):
+    mocked_start = mocker.patch("bloodaxe.start")
+    mocker.patch("bloodaxe.toml.load", return_value=toml_data)
+    mocker.patch("bloodaxe.set_event_loop_policy", return_value=True)
+
+    result = CliRunner().invoke(app, ["example.toml", "--verbose"])
+
+    assert result.exit_code == 0
+    mocked_start.assert_called_with(toml_data, True, metrics_port=None, metrics_host=DEFAULT_METRICS_HOST)
+
+
+def test_cli_runs_flow_by_default_with_leading_option(mocker, toml_data):
+    mocked_start = mocker.patch("bloodaxe.start")
+    mocker.patch("bloodaxe.toml.load", return_value=toml_data)
+    mocker.patch("bloodaxe.set_event_loop_policy", return_value=True)
+
+    result = CliRunner().invoke(app, ["--verbose", "example.toml"])
+
+    assert result.exit_code == 0
+    mocked_start.assert_called_with(toml_data, True, metrics_port=None, metrics_host=DEFAULT_METRICS_HOST)
+
+
+def test_cli_help_lists_commands():
+    result = CliRunner().invoke(app, ["--help"])
+
+    assert result.exit_code == 0
+    assert "replay" in result.output
+
+
+def test_cli_with_invalid_flow_config(mocker, toml_data):
+    mocked_start = mocker.patch("bloodaxe.start")
+    toml_data["request"][0]["compress"] = "br"
+    mocker.patch("bloodaxe.toml.load", return_value=toml_data)
+    mocker.patch("bloodaxe.set_event_loop_policy", return_value=True)
+
+    result = CliRunner().invoke(app, ["example.toml"])
+
+    assert result.exit_code == 1
+    assert "Invalid compress encoding, compress=br" in result.output
+    mocked_start.assert_not_called()
+
+
+def test_cli_with_invalid_configs(mocker, toml_data):
+    mocked_start = mocker.patch("bloodaxe.start")
+    toml_data["configs"]["virtual_users"] = 0
+    mocker.patch("bloodaxe.toml.load", return_value=toml_data)
+    mocker.patch("bloodaxe.set_event_loop_policy", return_value=True)
+
+    result = CliRunner().invoke(app, ["example.toml"])
+
+    assert result.exit_code == 1
+    assert "Invalid virtual_users, virtual_users=0" in result.output
+    mocked_start.assert_not_called()
+
+
+def test_cli_replay(mocker, toml_data, access_log):
+    mocked_replay = mocker.patch("bloodaxe.replay")
+    mocker.patch("bloodaxe.toml.load", return_value=toml_data)
+    mocker.patch("bloodaxe.set_event_loop_policy", return_value=True)
+
+    result = CliRunner().invoke(app, ["replay", "example.toml", str(access_log), "--speed", "10"])
+
+    assert result.exit_code == 0
+    mocked_replay.assert_called_with(
+        toml_data,
+        access_log,
+        LogFormat.auto,
+        10,
+        1000,
+        DEFAULT_TIMEOUT,
+        False,
+        metrics_port=None,
+        metrics_host=DEFAULT_METRICS_HOST,
+    )
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("mocked_echo")
+async def test_run_worker_discards_warmup_flows(httpserver, toml_data, get_user_response):
+    toml_data["api"][0]["base_url"] = f"http://{httpserver.host}:{httpserver.port}"
+    toml_data["request"] = toml_data["request"][:1]
+    httpserver.expect_request("/users/1", method="GET").respond_with_json(get_user_response)
+    metrics = Metrics()
+    end_time = time.time() + 0.5
+
+    await run_worker(toml_data, False, [VirtualUser()], {}, end_time, metrics, warmup_end_time=end_time)
+
+    assert len(httpserver.log) > 0
+    assert metrics.total_flows == 0
+    assert metrics.requests == {}
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("mocked_echo")
+async def test_run_worker_paces_each_virtual_user(httpserver, toml_data, get_user_response):
+    toml_data["api"][0]["base_url"] = f"http://{httpserver.host}:{httpserver.port}"
+    toml_data["configs"]["pacing"] = 0.3
+    toml_data["request"] = toml_data["request"][:1]
+    httpserver.expect_request("/users/1", method="GET").respond_with_json(get_user_response)
+    virtual_users = [VirtualUser(), VirtualUser()]
+    metrics = Metrics()
+    start_time = time.time()
+
+    await run_worker(toml_data, False, virtual_users, {}, start_time + 0.5, metrics)
+
+    assert metrics.success_flows == 4
+    assert all(
+        start_time + 0.6 < virtual_user.next_start_time < start_time + 0.7 for virtual_user in virtual_users
+    )
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("mocked_echo")
+async def test_run_worker_stops_launching_flows(toml_data):
+    stopping = asyncio.Event()
+    stopping.set()
+    metrics = Metrics()
+
+    await run_worker(toml_data, False, [VirtualUser()], {}, time.time() + 60, metrics, stopping=stopping)
+
+    assert metrics.total_flows == 0
+
+
+@pytest.mark.asyncio
+async def test_start_with_fewer_virtual_users_than_flows(mocker, toml_data, mocked_echo, mocked_secho):
+    mocker.patch("bloodaxe.show_metrics")
+    mocker.patch("bloodaxe.show_generator_stats")
+    mocked_run_worker = mocker.patch("bloodaxe.run_worker", new=asynctest.CoroutineMock())
+    toml_data["configs"]["number_of_concurrent_flows"] = 10
+    toml_data["configs"]["virtual_users"] = 2
+
+    await start(toml_data, verbose=False)
+
+    mocked_secho.assert_any_call(VIRTUAL_USERS_WARNING.format(2, 10, 2), fg=typer.colors.YELLOW, bold=True)
+    mocked_secho.assert_any_call(
+        START_MESSAGE.format(2, toml_data["configs"]["duration"]),
+        fg=typer.colors.CYAN,
+        underline=True,
+        bold=True,
+    )
+    assert mocked_run_worker.await_count == 2
+    assert all(len(call[0][2]) == 1 for call in mocked_run_worker.await_args_list)
+
+
+@pytest.mark.asyncio
+async def test_start_with_warmup(mocker, httpserver, toml_data, mocked_echo, mocked_secho, get_user_response):
+    mock_show_metrics = mocker.patch("bloodaxe.show_metrics")
+    mocker.patch("bloodaxe.show_generator_stats")
+    httpserver.expect_request("/users/1", method="GET").respond_with_json(get_user_response)
+    toml_data["api"][0]["base_url"] = f"http://{httpserver.host}:{httpserver.port}"
+    toml_data["request"] = toml_data["request"][:1]
+    toml_data["configs"]["warmup"] = 0.5
+    toml_data["configs"]["duration"] = 0.5
+
+    metrics = await start(toml_data, verbose=False)
+
+    mocked_secho.assert_any_call(WARMUP_MESSAGE.format(0.5), fg=typer.colors.CYAN)
+    assert 0 < metrics.success_flows < len(httpserver.log)
+    elapsed_seconds = mock_show_metrics.call_args[0][1]
+    assert 0.5 <= elapsed_seconds < 1
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("signum", [signal.SIGINT, signal.SIGTERM])
+async def test_start_stops_on_signal(
+    mocker, httpserver, toml_data, mocked_echo, mocked_secho, get_user_response, signum
+):
+    mock_show_metrics = mocker.patch("bloodaxe.show_metrics")
+    mocker.patch("bloodaxe.show_generator_stats")
+    httpserver.expect_request("/users/1", method="GET").respond_with_json(get_user_response)
+    toml_data["api"][0]["base_url"] = f"http://{httpserver.host}:{httpserver.port}"
+    toml_data["request"] = toml_data["request"][:1]
+    toml_data["configs"]["duration"] = 60
+    asyncio.get_event_loop().call_later(0.5, os.kill, os.getpid(), signum)
+
+    start_time = time.time()
+    metrics = await start(toml_data, verbose=False)
+
+    assert time.time() - start_time < 5
+    assert metrics.success_flows > 0
+    mock_show_metrics.assert_called_with(metrics, mocker.ANY)
+    mocked_secho.assert_any_call(STOP_MESSAGE.format(10), fg=typer.colors.YELLOW, bold=True)
+
+
+@pytest.mark.asyncio
+async def test_start_cancels_flows_after_shutdown_timeout(
+    mocker, httpserver, toml_data, mocked_echo, mocked_secho, get_user_response
+):
+    mock_show_metrics = mocker.patch("bloodaxe.show_metrics")
+    mocker.patch("bloodaxe.show_generator_stats")
+    httpserver.expect_request("/users/1", method="GET").respond_with_json(get_user_response)
+    toml_data["api"][0]["base_url"] = f"http://{httpserver.host}:{httpserver.port}"
+    toml_data["request"] = toml_data["request"][:1]
+    toml_data["request"][0]["think_time"] = 60
+    toml_data["configs"]["duration"] = 60
+    toml_data["configs"]["shutdown_timeout"] = 0.2
+    asyncio.get_event_loop().call_later(0.5, os.kill, os.getpid(), signal.SIGINT)
+
+    start_time = time.time()
+    metrics = await start(toml_data, verbose=False)
+
+    assert time.time() - start_time < 5
+    assert metrics.total_flows == 0
+    mock_show_metrics.assert_called_with(metrics, mocker.ANY)
+
+
+@pytest.fixture(params=[name for name in JSON_CODECS if importlib.util.find_spec(name)])
+def json_codec(request):
+    return make_json_codec(request.param)
+
+
+def test_json_codec(json_codec, post_user_response):
+    data = {"user": post_user_response, "ids": [1, 2, 3], "url": "http://test-url.com/users/", "ok": True}
+
+    encoded_data = json_codec.dumps(data)
+
+    assert isinstance(encoded_data, bytes)
+    assert json.loads(encoded_data) == data
+    assert json_codec.loads(encoded_data) == data
+    assert json_codec.loads(encoded_data.decode()) == data
+
+
+def test_make_json_codec_prefers_first_installed_codec(mocker):
+    mocked_import = mocker.patch(
+        "bloodaxe.importlib.import_module", side_effect=[ImportError, ImportError, json]
+    )
+
+    assert make_json_codec().name == "json"
+    assert [call[0][0] for call in mocked_import.call_args_list] == list(JSON_CODECS)
+
+
+def test_make_json_codec_with_invalid_codec(mocker):
+    mocked_import = mocker.patch("bloodaxe.importlib.import_module")
+
+    with pytest.raises(ValueError, match="Invalid json codec, codec=yaml"):
+        make_json_codec("yaml")
+
+    mocked_import.assert_not_called()
+
+
+def test_make_json_codec_with_codec_not_installed(mocker):
+    mocker.patch("bloodaxe.importlib.import_module", side_effect=ImportError)
+
+    with pytest.raises(ValueError, match="Invalid json codec, codec=orjson"):
+        make_json_codec("orjson")
+
+
+@pytest.mark.parametrize(
+    "data, headers, expected_body, expected_headers",
+    [
+        (None, None, None, None),
+        (b"raw", {"X-Name": "Ivar"}, b"raw", {"X-Name": "Ivar"}),
+        ({"name": "Ivar"}, None, encode_json({"name": "Ivar"}), {"Content-Type": JSON_CONTENT_TYPE}),
+        (
+            {"name": "Ivar"},
+            {"content-type": "application/x-www-form-urlencoded"},
+            encode_json({"name": "Ivar"}),
+            {"content-type": "application/x-www-form-urlencoded"},
+        ),
+    ],
+)
+def test_encode_request_body(data, headers, expected_body, expected_headers):
+    assert encode_request_body(data, headers) == (expected_body, expected_headers)
+
+
+@pytest.mark.asyncio
+async def test_make_post_request_sends_encoded_json(httpserver, response):
+    data = {"name": "lagertha", "shield": "maiden"}
+    httpserver.expect_request(
+        "/test/", method="POST", json=data, headers={"Content-Type": JSON_CONTENT_TYPE}
+    ).respond_with_json(response)
+
+    request_response = await make_post_request(
+        httpserver.url_for("/test/"), data=data, timeout=DEFAULT_TIMEOUT
+    )
+
+    assert request_response.json() == response
+
+
+@pytest.mark.parametrize("encoding, decompress", [("gzip", gzip.decompress), ("deflate", zlib.decompress)])
+def test_compress_request_body(encoding, decompress):
+    body = encode_json({"name": "Ivar", "bio": "boneless " * 100})
+    headers = {"Content-Type": JSON_CONTENT_TYPE}
+
+    compressed_body, compressed_headers = compress_request_body(body, headers, encoding)
+
+    assert decompress(compressed_body) == body
+    assert len(compressed_body) < len(body)
+    assert compressed_headers == {"Content-Type": JSON_CONTENT_TYPE, "Content-Encoding": encoding}
+    assert headers == {"Content-Type": JSON_CONTENT_TYPE}
+
+
+def test_compress_request_body_with_invalid_encoding():
+    with pytest.raises(ValueError, match="Invalid compress encoding, compress=br"):
+        compress_request_body(b"body", None, "br")
+
+
+@pytest.mark.parametrize(
+    "data, expected_static",
+    [
+        ({"name": "Ivar", "bio": "boneless"}, True),
+        ({"name": "{{ get_user.name }}"}, False),
+        ("{% if user %}Ivar{% endif %}", False),
+    ],
+)
+def test_is_static_template(data, expected_static):
+    assert is_static_template(data) is expected_static
+
+
+def test_make_static_body():
+    data = {"name": "Ivar", "bio": "boneless " * 100}
+
+    static_body = make_static_body({"name": "create_user", "compress": "gzip", "data": data})
+
+    assert static_body == StaticBody(gzip.compress(encode_json(data), mtime=0), len(encode_json(data)))
+
+
+@pytest.mark.parametrize(
+    "request_config",
+    [
+        {"name": "create_user", "compress": "gzip", "data": {"age": "{{ req_test.age }}"}},
+        {"name": "create_user", "data": {"name": "Ivar"}},
+        {"name": "create_user", "compress": "gzip"},
+    ],
+)
+def test_make_static_body_returns_none(request_config):
+    assert make_static_body(request_config) is None
+
+
+def test_make_static_body_with_from_file(mocker):
+    mocked_from_file = mocker.patch("bloodaxe.from_file", return_value={"name": "Ivar"})
+
+    static_body = make_static_body(
+        {"name": "create_user", "compress": "deflate", "data": {"from_file": "user.json"}}
+    )
+
+    mocked_from_file.assert_called_once_with("user.json")
+    assert zlib.decompress(static_body.compressed_body) == encode_json({"name": "Ivar"})
+
+
+def test_prepare_static_bodies():
+    static_request = {"name": "create_user", "compress": "gzip", "data": {"name": "Ivar"}}
+    templated_request = {"name": "update_user", "compress": "gzip", "data": {"age": "{{ req_test.age }}"}}
+    toml_data = {"configs": {"duration": 1}, "request": [static_request, templated_request]}
+
+    prepared_toml_data = prepare_static_bodies(toml_data)
+
+    assert prepared_toml_data["configs"] == {"duration": 1}
+    assert prepared_toml_data["request"][0]["static_body"] == make_static_body(static_request)
+    assert prepared_toml_data["request"][1] is templated_request
+    assert "static_body" not in static_request
+
+
+def test_prepare_request_skips_templating_for_static_body(mocker, context):
+    mocked_generate_request_data = mocker.patch("bloodaxe.generate_request_data")
+    static_body = StaticBody(b"compressed", 10)
+    request = {
+        "name": "create_user",
+        "url": "any_url",
+        "method": "POST",
+        "compress": "gzip",
+        "data": {"name": "Ivar"},
+        "static_body": static_body,
+    }
+
+    prepared_request = prepare_request(context, request)
+
+    mocked_generate_request_data.assert_not_called()
+    assert "data" not in prepared_request
+    assert prepared_request["static_body"] is static_body
+
+
+@pytest.mark.asyncio
+async def test_make_request_with_static_body(httpserver, context, response):
+    data = {"name": "lagertha", "bio": "shield maiden " * 100}
+    static_body = make_static_body({"name": "create_user", "compress": "gzip", "data": data})
+    received_requests = []
+
+    def handler(request):
+        received_requests.append(request)
+        return Response(encode_json(response), content_type=JSON_CONTENT_TYPE)
+
+    httpserver.expect_request("/users/", method="POST").respond_with_handler(handler)
+    metrics = Metrics()
+
+    await make_request(
+        context,
+        "create_user",
+        httpserver.url_for("/users/"),
+        "POST",
+        metrics=metrics,
+        compress="gzip",
+        static_body=static_body,
+        timeout=DEFAULT_TIMEOUT,
+    )
+
+    request_body = received_requests[0].get_data()
+    assert received_requests[0].headers["Content-Encoding"] == "gzip"
+    assert received_requests[0].headers["Content-Type"] == JSON_CONTENT_TYPE
+    assert json.loads(gzip.decompress(request_body)) == data
+    transfer_stats = metrics.transfers["create_user"]
+    assert transfer_stats.sent_bytes == len(static_body.compressed_body)
+    assert transfer_stats.sent_decoded_bytes == len(encode_json(data))
+
+
+@pytest.mark.asyncio
+async def test_make_request_with_compress(httpserver, context):
+    data = {"name": "lagertha", "bio": "shield maiden " * 100}
+    response_body = gzip.compress(encode_json(data))
+    received_requests = []
+
+    def handler(request):
+        received_requests.append(request)
+        return Response(response_body, headers={"Content-Encoding": "gzip"}, content_type=JSON_CONTENT_TYPE)
+
+    httpserver.expect_request("/users/", method="POST").respond_with_handler(handler)
+    metrics = Metrics()
+
+    result = await make_request(
+        context,
+        "create_user",
+        httpserver.url_for("/users/"),
+        "POST",
+        metrics=metrics,
+        compress="gzip",
+        data=data,
+        timeout=DEFAULT_TIMEOUT,
+    )
+
+    request_body = received_requests[0].get_data()
+    assert result == data
+    assert received_requests[0].headers["Content-Encoding"] == "gzip"
+    assert json.loads(gzip.decompress(request_body)) == data
+    transfer_stats = metrics.transfers["create_user"]
+    assert transfer_stats.sent_bytes == len(request_body)
+    assert transfer_stats.sent_decoded_bytes == len(encode_json(data))
+    assert transfer_stats.received_bytes == len(response_body)
+    assert transfer_stats.received_decoded_bytes == len(encode_json(data))
+
+
+def test_show_transfers(mocked_echo):
+    metrics = Metrics()
+    metrics.add_transfer("create_user", 100, 1000, 50, 200)
+    metrics.add_transfer("create_user", 100, 1000)
+
+    show_transfers(metrics)
+
+    mocked_echo.assert_called_with(
+        tabulate([["create_user", 200, 2000, 50, 200]], headers=TRANSFER_TABLE_HEADERS)
+    )
+
+
+def test_render_prometheus_metrics_with_transfers():
+    metrics = Metrics()
+    metrics.add_transfer("create_user", 100, 1000, 50, 200)
+
+    text = render_prometheus_metrics(metrics)
+
+    assert 'bloodaxe_request_bytes_total{request="create_user",encoding="wire"} 100' in text
+    assert 'bloodaxe_request_bytes_total{request="create_user",encoding="decoded"} 1000' in text
+    assert 'bloodaxe_response_bytes_total{request="create_user",encoding="wire"} 50' in text
+    assert 'bloodaxe_response_bytes_total{request="create_user",encoding="decoded"} 200' in text